@@ -3,16 +3,25 @@ import logging
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
 
-from config import DB_CLIENT, FIN_CALLBACK_URL, FIN_KEY_ID, FIN_OU_ID, FIN_SECRET_BASE64, MONGO_URI
+from config import FIN_CALLBACK_URL, FIN_KEY_ID, FIN_OU_ID, FIN_SECRET_BASE64, MONGO_INDEX_BOOTSTRAP
 from aadhar.log import log_data
+from aadhar.clients import LazyCollection, LazyDatabase
 
 from aadhar.pancard import pan_bp
 from aadhar.bharat import bharat_bp
-from aadhar.video_profile import profile_bp, video_kyc_reject_resend_link
-from aadhar.utils import added_time, aes_decrypt, aes_encrypt, ds_flow_server_auto_approved, found_file_link_idfy, generate_id, upload_files_to_s3
-from aadhar.idfy_utils import agent_code_auto, fetch_aadhaar_card_data
+from aadhar.admin import admin_bp
+from aadhar.video_profile import profile_bp
+from aadhar.utils import added_time, aes_decrypt, aes_encrypt, generate_id
+from aadhar.idfy_utils import fetch_aadhaar_card_data, start_aadhaar_task
+from aadhar.idfy_tasks import accept_task, task_bp, wants_async
+from aadhar.task_events import is_task_callback, publish_task_completion
+from aadhar.callback_jobs import enqueue_callback_job
+from aadhar.callback_ledger import claim_delivery, complete_delivery, delivery_id, release_delivery
+from aadhar.mongo_indexes import start_index_bootstrap
+from aadhar.projections import fields
+from aadhar.idempotency import idempotent
+from aadhar.circuit_breaker import CircuitOpenError, circuit_open_response, reject_while_open
 # from flasgger import Swagger
 
 
@@ -23,17 +32,36 @@ CORS(app)
 app.register_blueprint(pan_bp)
 app.register_blueprint(profile_bp)
 app.register_blueprint(bharat_bp)
+app.register_blueprint(admin_bp)
+app.register_blueprint(task_bp)
 
-# MongoDB's  connection string
-client = MongoClient(MONGO_URI)
-mongodb = client[DB_CLIENT]
-FIN_AADHAR = mongodb['Finvesta_Aadhar']
-FIN_VIDEO_KYC = mongodb['Finvesta_video_kyc']
-IDFY_DATA = mongodb['Idfy_data']
-PANCARD_DATA = mongodb['Finvesta_PanCard']
-FINVESTA_USERS = mongodb['finvesta_users']
-MDB_BHARAT_API_RECORDS = mongodb['bharat_api_records']
-DISTRIBUTOR_USERS = mongodb['distributor_users']
+app.before_request(reject_while_open)
+
+
+@app.errorhandler(CircuitOpenError)
+def circuit_open(e):
+    return circuit_open_response(e.name, e.retry_after)
+
+# MongoDB collections, bound to the worker's own client on first use (see aadhar/clients.py)
+mongodb = LazyDatabase()
+FIN_AADHAR = LazyCollection('Finvesta_Aadhar')
+FIN_VIDEO_KYC = LazyCollection('Finvesta_video_kyc')
+FIN_VIDEO_KYC_RAW = LazyCollection('Finvesta_video_kyc_raw')
+IDFY_DATA = LazyCollection('Idfy_data')
+PANCARD_DATA = LazyCollection('Finvesta_PanCard')
+FINVESTA_USERS = LazyCollection('finvesta_users')
+MDB_BHARAT_API_RECORDS = LazyCollection('bharat_api_records')
+DISTRIBUTOR_USERS = LazyCollection('distributor_users')
+IDFY_TASKS = LazyCollection('idfy_async_tasks')
+IDFY_TASK_EVENTS = LazyCollection('idfy_task_events')
+CALLBACK_JOBS = LazyCollection('callback_jobs')
+CALLBACK_LEDGER = LazyCollection('callback_ledger')
+CALLBACK_OUTBOX = LazyCollection('callback_outbox')
+INFLIGHT_REQUESTS = LazyCollection('inflight_requests')
+IDEMPOTENCY_KEYS = LazyCollection('idempotency_keys')
+
+if MONGO_INDEX_BOOTSTRAP:
+    start_index_bootstrap()
 
 # index 
 @app.route('/', methods=['GET'])
@@ -58,6 +86,7 @@ def index():
 
 
 @app.route('/aadharcard', methods=['POST'])
+@idempotent
 def aadharcard():
     """
     Aadhaar Card Verification - IDfy Digilocker url generate
@@ -135,8 +164,18 @@ def aadharcard():
                 "extra_fields": {}
                 }
             }
+
+        if wants_async():
+            request_id, error_response = start_aadhaar_task(headers, data)
+            if not request_id:
+                return error_response
+            return accept_task('aadhaar', request_id, reference_id=reference_id)
+
         return fetch_aadhaar_card_data(headers, data)
     
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         error_message = {"error": str(e)}
         log_data(message = error_message, event_type='/aadharcard', log_level=logging.ERROR)
@@ -178,12 +217,25 @@ def callback():
             # Aadhar card Reference id check 
             if data_type == 'ADHAR':
                 reference_id = idfy_received_data.get('reference_id')
-            
-                if FIN_AADHAR.find_one({'reference_id': reference_id}):
-                    return jsonify({"error": "Reference id already exists"}), 400
-                
-                idfy_received_data['data_received_time'] = added_time()
-                FIN_AADHAR.update_one({'request_ref_id': reference_id}, {'$set': idfy_received_data}, upsert=True)
+
+                # Redelivery of a callback already stored, acknowledge without touching FIN_AADHAR
+                ledger_key = claim_delivery('aadhaar', reference_id, idfy_received_data)
+                if ledger_key is None:
+                    log_data(message="Duplicate Aadhar callback skipped", event_type='/callback/aadhar/data', log_level=logging.INFO,
+                             additional_context = {'reference_id': reference_id})
+                    return "Received IDFY Aadhar Data", 200
+
+                try:
+                    if FIN_AADHAR.find_one({'reference_id': reference_id}, {'_id': 1}):
+                        release_delivery(ledger_key)
+                        return jsonify({"error": "Reference id already exists"}), 400
+
+                    idfy_received_data['data_received_time'] = added_time()
+                    FIN_AADHAR.update_one({'request_ref_id': reference_id}, {'$set': idfy_received_data}, upsert=True)
+                except Exception:
+                    release_delivery(ledger_key)
+                    raise
+                complete_delivery(ledger_key)
 
                 log_data(message="Received Aadhar data", event_type='/callback/aadhar/data', log_level=logging.INFO,
                           additional_context = {'reference_id': idfy_received_data['reference_id']})
@@ -193,37 +245,26 @@ def callback():
             # Video KYC Profile id check 
             profile_id = idfy_received_data.get('profile_id')
             if profile_id:
+                # A redelivered video callback must not re-run the archive, agent code or DS approval. The job is
+                # keyed by the delivery, so recording it and the dedup check are one insert; a failed job is queued again
+                job_id = delivery_id('video_kyc', profile_id, idfy_received_data)
+
                 idfy_received_data['data_received_time'] = added_time()
                 idfy_received_data['received_type'] = 'callback_url'
 
-                if idfy_received_data['reviewer_action'] == 'rejected':
-                    video_kyc_reject_resend_link(idfy_received_data, profile_id)
-                    FIN_VIDEO_KYC.update_one({'generate_profile_id': profile_id}, {'$set': idfy_received_data}, upsert=True)
+                # Archive, Mongo updates and side effects run on the callback job worker
+                if enqueue_callback_job('video_kyc', idfy_received_data, job_id=job_id) is None:
+                    log_data(message="Duplicate Video KYC callback skipped", event_type='/callback/video/KYC', log_level=logging.INFO,
+                             additional_context = {'profile_id': profile_id, 'reviewer_action': idfy_received_data.get('reviewer_action')})
                     return "Received Video KYC data", 200
-                
-                profile_id = idfy_received_data.get('profile_id')
-                file_data = found_file_link_idfy(idfy_received_data)
-
-                s3_file_urls = upload_files_to_s3(file_data, profile_id)
-
-                idfy_received_data['file_url_s3'] = s3_file_urls
-
-                FIN_VIDEO_KYC.update_one({'generate_profile_id': profile_id}, {'$set': idfy_received_data}, upsert=True)
-                log_data(message="Received Video KYC data", event_type='/callback/video/KYC', log_level=logging.INFO, 
-                         additional_context = {'profile_id': idfy_received_data['profile_id'], 'reviewer_action': idfy_received_data['reviewer_action']}) 
-                
-                agent_data = FIN_VIDEO_KYC.find_one({'generate_profile_id': profile_id})
-                log_data(message="check the agent data", event_type='/callback/video/KYC', log_level=logging.INFO, 
-                         additional_context = {'profile_id': idfy_received_data['profile_id']}) 
-                
-                if agent_data and agent_data.get('user_type') == 'agent' and idfy_received_data['status'] == 'completed':
-                    agent_code_auto(idfy_received_data, agent_data)
-
-                if (agent_data and agent_data.get('user_type') in ['ds', 'mds', 'fos'] and idfy_received_data.get('status') == 'completed'):
-                    ds_flow_server_auto_approved(idfy_received_data, agent_data)
-
+                log_data(message="Queued Video KYC callback", event_type='/callback/video/KYC', log_level=logging.INFO,
+                         additional_context = {'profile_id': profile_id, 'reviewer_action': idfy_received_data.get('reviewer_action')})
                 return "Received Video KYC data", 200
 
+            # IDfy async task finished, have the request or background task waiting on it check the status now
+            if is_task_callback(idfy_received_data):
+                publish_task_completion(idfy_received_data['request_id'])
+
             IDFY_DATA.insert_one(idfy_received_data)
             log_data(message="Received IDFY data", event_type='/callback/IDFY/data', log_level=logging.INFO, 
                      additional_context ={'profile_id': idfy_received_data.get('type', None)}) 
@@ -317,7 +358,7 @@ def aadhar_data():
         if not reference_id:
             return {"error": "Reference-id header is missing"}, 400
 
-        aadhar_data = FIN_AADHAR.find_one({'reference_id': reference_id})
+        aadhar_data = FIN_AADHAR.find_one({'reference_id': reference_id}, fields('aadhar_data'))
         if not aadhar_data:
             message = "No Aadhar data found for the provided reference_id"
             log_data(message = f"{message}:: {reference_id}", event_type = '/aadhar_data', log_level = logging.ERROR)
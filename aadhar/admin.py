@@ -0,0 +1,167 @@
+import os
+import hmac
+from flask import Blueprint, jsonify, request
+
+from config import ADMIN_API_TOKEN
+from aadhar import metrics
+
+
+# Create a Blueprint instance
+admin_bp = Blueprint('admin', __name__)
+
+
+@admin_bp.before_request
+def check_admin_token():
+    # Closed unless a token is configured
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(request.headers.get('Admin-Token', '').encode(), ADMIN_API_TOKEN.encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+
+
+@admin_bp.route('/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """
+    Worker Metrics
+    ---
+    tags:
+      - Admin
+    summary: Counters, gauges and timings of the gunicorn worker that served this call
+    responses:
+      200:
+        description: Metrics snapshot
+        schema:
+          type: object
+      401:
+        description: Admin-Token header missing or wrong
+    """
+    data = metrics.snapshot()
+    data['pid'] = os.getpid()
+    return jsonify(data), 200
+
+
+@admin_bp.route('/admin/outbox/dead-letters', methods=['GET'])
+def outbox_dead_letters():
+    """
+    Outbox Dead Letters
+    ---
+    tags:
+      - Admin
+    summary: Callback side effects that ran out of attempts
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        default: 100
+    responses:
+      200:
+        description: Failed outbox entries, newest first
+      401:
+        description: Admin-Token header missing or wrong
+    """
+    from aadhar.outbox import dead_letters
+
+    entries = dead_letters(limit=request.args.get('limit', 100, type=int))
+    for entry in entries:
+        entry['_id'] = str(entry['_id'])
+    return jsonify({"dead_letters": entries}), 200
+
+
+@admin_bp.route('/admin/outbox/<entry_id>/retry', methods=['POST'])
+def outbox_retry(entry_id):
+    """
+    Retry Outbox Entry
+    ---
+    tags:
+      - Admin
+    summary: Put a dead-lettered side effect back on the outbox with a fresh attempt budget
+    parameters:
+      - name: entry_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Entry requeued
+      404:
+        description: No failed entry with this id
+    """
+    from aadhar.outbox import requeue_dead_letter
+
+    if not requeue_dead_letter(entry_id):
+        return jsonify({"error": "No failed outbox entry with this id"}), 404
+    return jsonify({"status": "requeued"}), 200
+
+
+@admin_bp.route('/admin/callback-jobs/failed', methods=['GET'])
+def callback_jobs_failed():
+    """
+    Failed Callback Jobs
+    ---
+    tags:
+      - Admin
+    summary: Queued /callback jobs that ran out of attempts
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        default: 100
+    responses:
+      200:
+        description: Failed callback jobs, newest first
+      401:
+        description: Admin-Token header missing or wrong
+    """
+    from aadhar.callback_jobs import failed_jobs
+
+    jobs = failed_jobs(limit=request.args.get('limit', 100, type=int))
+    for job in jobs:
+        job['_id'] = str(job['_id'])
+    return jsonify({"failed_jobs": jobs}), 200
+
+
+@admin_bp.route('/admin/callback-jobs/<job_id>/retry', methods=['POST'])
+def callback_job_retry(job_id):
+    """
+    Retry Callback Job
+    ---
+    tags:
+      - Admin
+    summary: Put a failed callback job back on the queue with a fresh attempt budget
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Job requeued
+      404:
+        description: No failed job with this id
+    """
+    from aadhar.callback_jobs import requeue_failed_job
+
+    if not requeue_failed_job(job_id):
+        return jsonify({"error": "No failed callback job with this id"}), 404
+    return jsonify({"status": "requeued"}), 200
+
+
+@admin_bp.route('/admin/circuits', methods=['GET'])
+def circuit_states():
+    """
+    Circuit Breakers
+    ---
+    tags:
+      - Admin
+    summary: Breaker state per vendor endpoint in the gunicorn worker that served this call
+    responses:
+      200:
+        description: State, calls in the rolling window, error and slow rates per endpoint
+        schema:
+          type: object
+      401:
+        description: Admin-Token header missing or wrong
+    """
+    from aadhar.circuit_breaker import breaker_states
+
+    return jsonify({"pid": os.getpid(), "circuits": breaker_states()}), 200
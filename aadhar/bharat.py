@@ -3,8 +3,12 @@ from flask import request, jsonify, Blueprint
 from dotenv import load_dotenv
 from aadhar.log import log_data
 from config import AADHAAR_OTP_SENT_URL, AADHAAR_OTP_SUBMIT_URL, CUSTOMER_ID, PRIVATE_API_KEY, BHARAT_PAN_VERIFY_URL, BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS, BANK_ACCOUNT_PENNYDROP_SEND_URL, BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL, SERVICE_VENDOR
-import requests
+from aadhar.http_client import vendor_request
 from aadhar.utils import get_current_time_in_ist, generate_id, upload_files_to_s3_bharat
+from aadhar.projections import fields
+from aadhar.single_flight import flight_key, single_flight
+from aadhar.idempotency import idempotent
+from aadhar.circuit_breaker import CircuitOpenError
 
 
 load_dotenv()
@@ -51,6 +55,7 @@ def get_service_vendor():
 
 
 @bharat_bp.route('/aadhaar/send-otp', methods=['POST'])
+@idempotent
 def send_otp():
     """
     Send Aadhaar OTP 
@@ -139,7 +144,7 @@ def send_otp():
             "private-api-key": PRIVATE_API_KEY
         }
    
-        response = requests.post(AADHAAR_OTP_SENT_URL, json=payload, headers=headers)
+        response = vendor_request('bharat', 'POST', AADHAAR_OTP_SENT_URL, json=payload, headers=headers)
         log_data(message="Recevied the response from bharat aadhaar sent otp", event_type='/aadhaar/send-otp', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': payload, 'response_data': response.json()})
         
@@ -175,6 +180,9 @@ def send_otp():
             return jsonify({"error": response.json().get("error", "aadhaar must be correct")}), response.status_code
 
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=f"Exception error: {str(e)}", event_type='/aadhaar/send-otp', log_level=logging.ERROR)
         return jsonify({"error": str(e)}), 500
@@ -285,7 +293,7 @@ def submit_verify_otp():
             "private-api-key": PRIVATE_API_KEY
         }
 
-        response = requests.post(AADHAAR_OTP_SUBMIT_URL, json=payload, headers=headers)
+        response = vendor_request('bharat', 'POST', AADHAAR_OTP_SUBMIT_URL, json=payload, headers=headers)
         response_json = response.json()
         log_data(message="Recevied the response form Bharat aadhaar verify", event_type='/aadhaar/verify-otp', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': payload, 'response_data': response_json})
@@ -338,6 +346,9 @@ def submit_verify_otp():
                      additional_context = {'request_data': data, 'return_data': {"error": response_json.json().get("error", "unable to verify")}, 'status_code': response.status_code})
             return jsonify({"error": response_json.json().get("error", "unable to verify")}), response.status_code
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=f"Exception error: {str(e)}", event_type='/aadhaar/verify-otp', log_level=logging.ERROR)
         return jsonify({"error": str(e)}), 500
@@ -437,7 +448,7 @@ def verify_pan():
             "private-api-key": PRIVATE_API_KEY
         } 
 
-        response = requests.post(BHARAT_PAN_VERIFY_URL, json=payload, headers=headers)
+        response = vendor_request('bharat', 'POST', BHARAT_PAN_VERIFY_URL, json=payload, headers=headers)
         log_data(message="Response data from bharat pan verify", event_type='/pan/verify', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': payload, 'response_data': response.json(), 'response_status_code': response.status_code}) 
 
@@ -469,6 +480,9 @@ def verify_pan():
                 "response": response.json()
             }), response.status_code
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=f"Exception error: {str(e)}", event_type='/pan/verify', log_level=logging.ERROR)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
@@ -549,61 +563,75 @@ def bank_account_send_request():
             return jsonify({"status": "error", "code": 400, "error": "Invalid IFSC code"}), 400
      
         # Check if the bank account and IFSC already exist in the database that responded with a completed status
-        exists_data = MDB_BHARAT_API_RECORDS.find_one({"type": "bank_account", "status": "completed", "bank_account": bank_account, "ifsc": ifsc})
+        exists_data = MDB_BHARAT_API_RECORDS.find_one({"type": "bank_account", "status": "completed", "bank_account": bank_account, "ifsc": ifsc},
+                                                    fields('bank_account_cache'))
         if exists_data:
             log_data(message="User request and response data", event_type='/bank-account/send-request', log_level=logging.INFO, 
                      additional_context = {'request_data': data, 'return_data': exists_data.get('verify_response').get("data", {}), 'status_code': 200}) 
             return jsonify(exists_data.get('verify_response').get("data", {})), 200
 
-        request_id = generate_id()
-        payload = {
-            "request_id": request_id,
-            "bank_account": bank_account,
-            "ifsc": ifsc
-        }
+        # Concurrent submits of the same account share one penny-drop request
+        response_body, status_code = single_flight(flight_key('bank_account', bank_account, ifsc),
+                                                   lambda: send_bank_account_request(data, bank_account, ifsc))
+        return jsonify(response_body), status_code
 
-        headers = {
-            "Content-Type": "application/json",
-            "customer-id": CUSTOMER_ID,
-            "private-api-key": PRIVATE_API_KEY
-        }
-       
-        response = requests.post(BANK_ACCOUNT_PENNYDROP_SEND_URL, json=payload, headers=headers)
-        log_data(message="Response data from bharat bank-account", event_type='/bank-account/send-request', log_level=logging.INFO, 
-                 additional_context = {'payload_data_json': payload, 'response_data': response.json(), 'status_code': response.status_code}) 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
+    except Exception as e:
+        log_data(message=f"Exception error: {str(e)}", event_type='/bank-account/send-request', log_level=logging.ERROR)
+        return jsonify({"error": str(e)}), 500
 
-        result_id = response.json().get("data", {}).get("result_id")
 
-        MDB_BHARAT_API_RECORDS.insert_one({
-            "bank_account": bank_account,
-            "ifsc": ifsc,
+# Penny-drop request to Bharat, returns (body, status_code)
+def send_bank_account_request(data, bank_account, ifsc):
+    from aadhar.aadhar import MDB_BHARAT_API_RECORDS
+
+    request_id = generate_id()
+    payload = {
+        "request_id": request_id,
+        "bank_account": bank_account,
+        "ifsc": ifsc
+    }
+
+    headers = {
+        "Content-Type": "application/json",
+        "customer-id": CUSTOMER_ID,
+        "private-api-key": PRIVATE_API_KEY
+    }
+
+    response = vendor_request('bharat', 'POST', BANK_ACCOUNT_PENNYDROP_SEND_URL, json=payload, headers=headers)
+    log_data(message="Response data from bharat bank-account", event_type='/bank-account/send-request', log_level=logging.INFO, 
+             additional_context = {'payload_data_json': payload, 'response_data': response.json(), 'status_code': response.status_code}) 
+
+    result_id = response.json().get("data", {}).get("result_id")
+
+    MDB_BHARAT_API_RECORDS.insert_one({
+        "bank_account": bank_account,
+        "ifsc": ifsc,
+        "request_id": request_id,
+        "result_id": result_id,
+        "status": "pending" if response.status_code == 200 else "failed",
+        "created_at": get_current_time_in_ist(),
+        "updated_at": get_current_time_in_ist(),
+        "sent_response": response.json(),
+        "type": "bank_account"
+    })
+
+    if response.status_code == 200:
+        log_data(message="User request and response data", event_type='/bank-account/send-request', log_level=logging.INFO, 
+                 additional_context = {'request_data': data, 'return_data': {"message": "Request sent successfully", "request_id": request_id,
+                                                                             "result_id": result_id}, 'status_code': 200}) 
+        return {
+            "message": "Request sent successfully",
             "request_id": request_id,
-            "result_id": result_id,
-            "status": "pending" if response.status_code == 200 else "failed",
-            "created_at": get_current_time_in_ist(),
-            "updated_at": get_current_time_in_ist(),
-            "sent_response": response.json(),
-            "type": "bank_account"
-        })
-
-        if response.status_code == 200:
-            log_data(message="User request and response data", event_type='/bank-account/send-request', log_level=logging.INFO, 
-                     additional_context = {'request_data': data, 'return_data': {"message": "Request sent successfully", "request_id": request_id,
-                                                                                 "result_id": result_id}, 'status_code': 200}) 
-            return jsonify({
-                "message": "Request sent successfully",
-                "request_id": request_id,
-                "result_id": result_id
-            }), 200
-        
-        else:
-            log_data(message="User request and response data", event_type='/bank-account/send-request', log_level=logging.ERROR, 
-                     additional_context = {'request_data': data, 'return_data': {"error": response.json().get("error", "Invalid request"), 'status_code': response.status_code}}) 
-            return jsonify({"error": response.json().get("error", "Invalid request")}), response.status_code
+            "result_id": result_id
+        }, 200
 
-    except Exception as e:
-        log_data(message=f"Exception error: {str(e)}", event_type='/bank-account/send-request', log_level=logging.ERROR)
-        return jsonify({"error": str(e)}), 500
+    else:
+        log_data(message="User request and response data", event_type='/bank-account/send-request', log_level=logging.ERROR, 
+                 additional_context = {'request_data': data, 'return_data': {"error": response.json().get("error", "Invalid request"), 'status_code': response.status_code}}) 
+        return {"error": response.json().get("error", "Invalid request")}, response.status_code
 
 
 @bharat_bp.route('/bank-account/get-status', methods=['POST'])
@@ -689,7 +717,7 @@ def bank_account_get_status():
         if not all([request_id, result_id]):
             return jsonify({"error": "Both 'request_id' and 'result_id' are required"}), 400
 
-        record = MDB_BHARAT_API_RECORDS.find_one({"request_id": request_id, "result_id": result_id})
+        record = MDB_BHARAT_API_RECORDS.find_one({"request_id": request_id, "result_id": result_id}, fields('bank_account_status'))
         if not record:
             return jsonify({"error": "Record not found"}), 404
 
@@ -704,7 +732,7 @@ def bank_account_get_status():
             "private-api-key": PRIVATE_API_KEY
         }
         
-        response = requests.post(BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL, json=payload, headers=headers)
+        response = vendor_request('bharat', 'POST', BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL, json=payload, headers=headers)
         log_data(message="Response data from bharat bank-account", event_type='/bank-account/get-status', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': payload, 'response_data': response.json(), 'status_code': response.status_code}) 
 
@@ -729,6 +757,9 @@ def bank_account_get_status():
                      additional_context = {'request_data': data, 'return_data': {"error": response.json().get("error", "Unable to get status"), 'status_code': response.status_code}}) 
             return jsonify({"error": response.json().get("error", "Unable to get status")}), response.status_code
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=f"Exception error: {str(e)}", event_type='/bank-account/get-status', log_level=logging.ERROR)
         return jsonify({"error": str(e)}), 500
@@ -826,7 +857,7 @@ def verify_bank_account():
             "private-api-key": PRIVATE_API_KEY
         }
 
-        response = requests.post(BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS, json=payload, headers=headers)
+        response = vendor_request('bharat', 'POST', BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS, json=payload, headers=headers)
         response_data = response.json()
         log_data(message="Response data from bharat", event_type='/bank-account/verify', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': payload, 'response_data': response_data, 'status_code': response.status_code}) 
@@ -860,6 +891,9 @@ def verify_bank_account():
                 "response": response_data
             }), response.status_code
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=f"Exception error: {str(e)}", event_type='/bank-account/verify', log_level=logging.ERROR)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
@@ -0,0 +1,301 @@
+import os
+import time
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config import (CALLBACK_JOB_LEASE_SECONDS, CALLBACK_JOB_MAX_ATTEMPTS, CALLBACK_JOB_MODE, CALLBACK_JOB_POLL_INTERVAL,
+                    CALLBACK_JOB_RETRY_BASE, CALLBACK_WORKER_CONCURRENCY, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE)
+from aadhar import metrics
+from aadhar.log import log_data
+from aadhar.utils import found_file_link_idfy, upload_files_to_s3
+from aadhar.outbox import OUTBOX_HANDLERS, outbox_transaction, record_effect
+from aadhar.callback_ledger import payload_hash
+from aadhar.payload_store import kyc_update
+from aadhar.projections import fields
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ Callback job queue ------------------------------------------------>
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+class StageTimer:
+    def __init__(self, kind):
+        self.kind = kind
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - started
+            self.stages[name] = round(seconds, 3)
+            metrics.observe(f'callback_jobs.{self.kind}.{name}', seconds)
+
+
+def enqueue_callback_job(kind, payload, job_id=None):
+    """
+    Persist the raw callback payload as a pending job; the caller can acknowledge right after.
+    With a job_id (see callback_ledger.delivery_id) the insert is also the dedup check: returns
+    None when that delivery already has a job, except a failed one, which is queued again.
+    """
+    from aadhar.aadhar import CALLBACK_JOBS
+
+    job = {
+        'kind': kind,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'available_at': _now(),
+        'created_at': _now(),
+    }
+    if job_id is not None:
+        job['_id'] = job_id
+    try:
+        job_id = CALLBACK_JOBS.insert_one(job).inserted_id
+    except DuplicateKeyError:
+        # Keeps the stored payload, so the outbox keys of a partly done first run still match
+        revived = CALLBACK_JOBS.update_one({'_id': job_id, 'status': 'failed'},
+                                           {'$set': {'status': 'pending', 'attempts': 0, 'available_at': _now()}})
+        if not revived.modified_count:
+            metrics.incr(f'callback_jobs.{kind}.duplicates')
+            return None
+        metrics.incr(f'callback_jobs.{kind}.revived')
+    metrics.incr(f'callback_jobs.{kind}.enqueued')
+
+    if CALLBACK_JOB_MODE == 'local':
+        start_local_worker()
+        _wake_up.set()
+    return job_id
+
+
+# <------------------------------------------------ Video KYC callback processing ------------------------------------------------>
+
+def process_video_kyc_callback(idfy_received_data, timer, job):
+    from aadhar.aadhar import FIN_VIDEO_KYC
+
+    profile_id = idfy_received_data.get('profile_id')
+    # Same for every retry of this job, so its outbox entries are recorded once
+    delivery = f"{profile_id}:{payload_hash(idfy_received_data)}"
+    client = FIN_VIDEO_KYC.database.client
+
+    if idfy_received_data['reviewer_action'] == 'rejected':
+        with timer.stage('mongo_update'), outbox_transaction(client) as session:
+            FIN_VIDEO_KYC.update_one({'generate_profile_id': profile_id}, kyc_update(profile_id, 'callback', idfy_received_data, session),
+                                     upsert=True, session=session)
+            record_effect('resend_link', delivery, {'idfy_received_data': idfy_received_data, 'profile_id': profile_id}, session)
+        _wake_up.set()
+        return
+
+    with timer.stage('s3_upload'):
+        previous = FIN_VIDEO_KYC.find_one({'generate_profile_id': profile_id}, fields('video_kyc_archive')) or {}
+        file_data = found_file_link_idfy(idfy_received_data)
+        s3_file_urls, file_archive = upload_files_to_s3(file_data, profile_id, previous.get('file_archive'), raise_errors=True)
+
+    idfy_received_data['file_url_s3'] = s3_file_urls
+    idfy_received_data['file_archive'] = file_archive
+
+    # The KYC update and the side effects it triggers are committed together; the effects run from the outbox
+    with timer.stage('mongo_update'), outbox_transaction(client) as session:
+        agent_data = FIN_VIDEO_KYC.find_one_and_update({'generate_profile_id': profile_id}, kyc_update(profile_id, 'callback', idfy_received_data, session),
+                                                       projection=fields('video_kyc_agent'), upsert=True, return_document=ReturnDocument.AFTER, session=session)
+
+        completed = idfy_received_data.get('status') == 'completed'
+        user_type = agent_data.get('user_type')
+        effect_payload = {'idfy_received_data': idfy_received_data, 'agent_data': agent_data}
+        if completed and user_type == 'agent':
+            record_effect('agent_code', delivery, effect_payload, session)
+        if completed and user_type in ['ds', 'mds', 'fos']:
+            record_effect('ds_auto_approve', delivery, effect_payload, session)
+    _wake_up.set()
+
+    log_data(message="Received Video KYC data", event_type='/callback/video/KYC', log_level=logging.INFO,
+             additional_context = {'profile_id': idfy_received_data['profile_id'], 'reviewer_action': idfy_received_data['reviewer_action'],
+                                   'user_type': user_type})
+
+
+JOB_HANDLERS = {
+    'video_kyc': process_video_kyc_callback,
+}
+
+
+# <------------------------------------------------ Worker ------------------------------------------------>
+
+class JobQueue:
+    def __init__(self, name, collection_name, handlers, max_attempts, retry_base, lease_seconds):
+        self.name = name
+        self.collection_name = collection_name
+        self.handlers = handlers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease_seconds = lease_seconds
+
+    @property
+    def collection(self):
+        import aadhar.aadhar
+        return getattr(aadhar.aadhar, self.collection_name)
+
+
+# Video KYC callbacks, and the side effects they record in the outbox
+JOB_QUEUES = [
+    JobQueue('callback_jobs', 'CALLBACK_JOBS', JOB_HANDLERS, CALLBACK_JOB_MAX_ATTEMPTS, CALLBACK_JOB_RETRY_BASE, CALLBACK_JOB_LEASE_SECONDS),
+    JobQueue('outbox', 'CALLBACK_OUTBOX', OUTBOX_HANDLERS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE, OUTBOX_LEASE_SECONDS),
+]
+
+
+def _claim_job(queue, worker_id):
+    now = _now()
+    return queue.collection.find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'available_at': {'$lte': now}},
+            # A worker died mid-job, its lease ran out
+            {'status': 'running', 'lease_until': {'$lt': now}},
+        ]},
+        {'$set': {'status': 'running', 'worker': worker_id, 'started_at': now,
+                  'lease_until': now + timedelta(seconds=queue.lease_seconds)},
+         '$inc': {'attempts': 1}},
+        sort=[('available_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _keep_lease(queue, job, stop):
+    # Renew the claim while the handler runs, a slow archive must not look abandoned
+    while not stop.wait(queue.lease_seconds / 3):
+        try:
+            queue.collection.update_one({'_id': job['_id'], 'status': 'running', 'worker': job.get('worker')},
+                                        {'$set': {'lease_until': _now() + timedelta(seconds=queue.lease_seconds)}})
+        except Exception as e:
+            logger.error("Failed to renew the lease of %s job %s: %s", queue.name, job['_id'], e)
+
+
+def run_job(job, queue=JOB_QUEUES[0]):
+    collection = queue.collection
+    timer = StageTimer(job['kind'])
+    started = time.monotonic()
+    # Completion only lands while this worker still holds the claim
+    owned = {'_id': job['_id'], 'status': 'running', 'worker': job.get('worker')}
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(queue, job, stop), name=f'{queue.name}-lease', daemon=True).start()
+    try:
+        queue.handlers[job['kind']](job['payload'], timer, job)
+
+    except Exception as e:
+        stop.set()
+        attempts = job.get('attempts', 1)
+        dead = attempts >= queue.max_attempts
+        collection.update_one(owned, {'$set': {
+            'status': 'failed' if dead else 'pending',
+            'available_at': _now() + timedelta(seconds=queue.retry_base * 2 ** (attempts - 1)),
+            'last_error': str(e),
+            'stages': timer.stages,
+        }, '$unset': {'lease_until': ''}})
+        metrics.incr(f"{queue.name}.{job['kind']}.{'dead' if dead else 'retried'}")
+        log_data(message=f"Callback job failed: {e}", event_type='/callback/jobs', log_level=logging.ERROR,
+                 additional_context={'job_id': str(job['_id']), 'queue': queue.name, 'kind': job['kind'], 'attempts': attempts, 'dead': dead})
+        return False
+
+    stop.set()
+    collection.update_one(owned, {'$set': {
+        'status': 'done',
+        'finished_at': _now(),
+        'stages': timer.stages,
+    }, '$unset': {'lease_until': ''}})
+    metrics.incr(f"{queue.name}.{job['kind']}.done")
+    metrics.observe(f"{queue.name}.{job['kind']}", time.monotonic() - started)
+    return True
+
+
+def failed_jobs(limit=100):
+    from aadhar.aadhar import CALLBACK_JOBS
+
+    return list(CALLBACK_JOBS.find({'status': 'failed'},
+                                   {'kind': 1, 'attempts': 1, 'last_error': 1, 'created_at': 1, 'available_at': 1, 'stages': 1})
+                .sort('created_at', -1).limit(limit))
+
+
+def requeue_failed_job(job_id):
+    # Fresh attempt budget; False when job_id is not a failed job
+    from aadhar.aadhar import CALLBACK_JOBS
+
+    try:
+        job_id = ObjectId(job_id)
+    except InvalidId:
+        pass   # delivery-keyed jobs have string ids
+
+    result = CALLBACK_JOBS.update_one({'_id': job_id, 'status': 'failed'},
+                                      {'$set': {'status': 'pending', 'attempts': 0, 'available_at': _now()}})
+    if result.matched_count:
+        wake_up_workers()
+    return bool(result.matched_count)
+
+
+_wake_up = threading.Event()
+
+
+def wake_up_workers():
+    # Only reaches the local worker of this process; a separate worker finds the job on its next poll
+    _wake_up.set()
+
+
+def run_worker(concurrency=CALLBACK_WORKER_CONCURRENCY, stop_event=None):
+    """
+    Claim and run jobs from every queue until stop_event is set, at most `concurrency` at a time.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def _run(job, queue):
+        try:
+            run_job(job, queue)
+        finally:
+            slots.release()
+
+    while not (stop_event and stop_event.is_set()):
+        claimed = False
+        for queue in JOB_QUEUES:
+            slots.acquire()
+            try:
+                job = _claim_job(queue, worker_id)
+            except Exception as e:
+                slots.release()
+                logger.error("Failed to claim a %s job: %s", queue.name, e)
+                continue
+
+            if job is None:
+                slots.release()
+                continue
+
+            claimed = True
+            threading.Thread(target=_run, args=(job, queue), name=f'{queue.name}-job', daemon=True).start()
+
+        if not claimed:
+            _wake_up.wait(CALLBACK_JOB_POLL_INTERVAL)
+            _wake_up.clear()
+
+
+_local_worker_state = {'pid': None}
+_local_worker_lock = threading.Lock()
+
+
+def start_local_worker():
+    # Stand-in for the separate worker process: the web worker drains the queue itself
+    if _local_worker_state['pid'] == os.getpid():
+        return
+    with _local_worker_lock:
+        if _local_worker_state['pid'] != os.getpid():
+            _local_worker_state['pid'] = os.getpid()
+            threading.Thread(target=run_worker, name='callback-local-worker', daemon=True).start()
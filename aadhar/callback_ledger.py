@@ -0,0 +1,70 @@
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from config import CALLBACK_LEDGER_RECLAIM_SECONDS
+from aadhar import metrics
+from aadhar.mongo_indexes import require_unique_indexes
+
+
+# <------------------------------------------------ Callback dedup ledger ------------------------------------------------>
+
+def payload_hash(payload):
+    # Key order and whitespace differ between deliveries of the same event
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def delivery_id(kind, subject_id, payload):
+    # Same for every delivery of the same event; used as the _id of the job that processes it
+    return f"{kind}:{subject_id}:{payload.get('status')}:{payload.get('reviewer_action')}:{payload_hash(payload)}"
+
+
+def claim_delivery(kind, subject_id, payload):
+    """
+    Record a callback delivery in the ledger (unique index callback_ledger_dedup, created
+    before the first insert). Returns the ledger key when this delivery is to be processed,
+    None when the same event was already processed or is being processed (by any worker or
+    pod). A claim that was never marked done within CALLBACK_LEDGER_RECLAIM_SECONDS (the
+    process died mid-way) is handed to the redelivery. Call complete_delivery once the
+    work is stored, and call it before adding server-side fields to the payload.
+    """
+    from aadhar.aadhar import CALLBACK_LEDGER
+
+    key = {
+        'kind': kind,
+        'subject_id': subject_id,
+        'status': payload.get('status'),
+        'reviewer_action': payload.get('reviewer_action'),
+        'payload_hash': payload_hash(payload),
+    }
+    require_unique_indexes(CALLBACK_LEDGER)
+    now = datetime.now(timezone.utc)
+    try:
+        CALLBACK_LEDGER.insert_one(dict(key, state='pending', claimed_at=now, created_at=now))
+    except DuplicateKeyError:
+        reclaimed = CALLBACK_LEDGER.update_one(
+            dict(key, state='pending', claimed_at={'$lt': now - timedelta(seconds=CALLBACK_LEDGER_RECLAIM_SECONDS)}),
+            {'$set': {'claimed_at': now}})
+        if not reclaimed.modified_count:
+            metrics.incr(f'callback_ledger.{kind}.duplicates')
+            return None
+        metrics.incr(f'callback_ledger.{kind}.reclaimed')
+
+    metrics.incr(f'callback_ledger.{kind}.recorded')
+    return key
+
+
+def complete_delivery(key):
+    from aadhar.aadhar import CALLBACK_LEDGER
+
+    CALLBACK_LEDGER.update_one(key, {'$set': {'state': 'done'}})
+
+
+def release_delivery(key):
+    # Processing failed after the claim; let IDfy's redelivery go through
+    from aadhar.aadhar import CALLBACK_LEDGER
+
+    CALLBACK_LEDGER.delete_one(key)
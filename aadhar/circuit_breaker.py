@@ -0,0 +1,192 @@
+import time
+import logging
+import threading
+from collections import deque
+
+from flask import jsonify, request
+
+from config import (AADHAAR_OTP_SENT_URL, AADHAAR_OTP_SUBMIT_URL, AADHAR_URL, AGENT_CODE_AUTO_URL, BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL,
+                    BANK_ACCOUNT_PENNYDROP_SEND_URL, BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS, BHARAT_PAN_VERIFY_URL, CIRCUIT_ERROR_RATE,
+                    CIRCUIT_MIN_REQUESTS, CIRCUIT_OPEN_SECONDS, CIRCUIT_SLOW_RATE, CIRCUIT_SLOW_SECONDS, CIRCUIT_WINDOW_SECONDS,
+                    PANCARD_URL, PROFILE_URL)
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+# Not a RequestException: callers that swallow transport errors must let this one reach the 503 handler
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# <------------------------------------------------ Circuit breaker ------------------------------------------------>
+
+class CircuitBreaker:
+    """
+    Rolling window of outcomes for one vendor endpoint. Opens when enough calls in the window
+    failed or were slow, rejects calls for CIRCUIT_OPEN_SECONDS, then lets a single probe
+    through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+        self.reserved = None   # (thread id, monotonic deadline) of the request let through the route gate as the probe
+        self.window = deque()   # (finished_at, failed, slow)
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self.window and self.window[0][0] < now - CIRCUIT_WINDOW_SECONDS:
+            self.window.popleft()
+
+    def _probe_taken(self, now):
+        # Called with the lock held
+        if self.reserved and self.reserved[1] < now:
+            # The reserved request never reached vendor_request (cache hit, bad input); free the slot
+            self.reserved = None
+        return self.probing or self.reserved is not None
+
+    def retry_after(self):
+        # Seconds until a call may go through, 0 when it may go now. Once the open period is over the
+        # breaker goes half-open here too: the routes checking it may be the endpoint's only callers.
+        # The probe slot is reserved for the calling thread right away, concurrent callers are turned away
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self.opened_at + CIRCUIT_OPEN_SECONDS - now
+                if remaining > 0:
+                    return max(1, int(remaining + 0.999))
+                self._move(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probe_taken(now):
+                    return 1
+                self.reserved = (threading.get_ident(), now + CIRCUIT_OPEN_SECONDS)
+            return 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < CIRCUIT_OPEN_SECONDS:
+                    metrics.incr(f'circuit.{self.name}.rejected')
+                    raise CircuitOpenError(self.name, max(1, int(self.opened_at + CIRCUIT_OPEN_SECONDS - time.monotonic() + 0.999)))
+                self._move(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.reserved and self.reserved[0] == threading.get_ident():
+                    self.reserved = None
+                elif self._probe_taken(time.monotonic()):
+                    metrics.incr(f'circuit.{self.name}.rejected')
+                    raise CircuitOpenError(self.name, 1)
+                self.probing = True
+
+    def after_call(self, failed, seconds):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                self.reserved = None
+                if failed:
+                    self._move(OPEN)
+                else:
+                    self.window.clear()
+                    self._move(CLOSED)
+                return
+
+            self.window.append((now, failed, seconds >= CIRCUIT_SLOW_SECONDS))
+            self._trim(now)
+            if self.state == CLOSED and len(self.window) >= CIRCUIT_MIN_REQUESTS:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= CIRCUIT_ERROR_RATE or slow_rate >= CIRCUIT_SLOW_RATE:
+                    self._move(OPEN)
+
+    def _rates(self):
+        calls = len(self.window) or 1
+        return (sum(1 for _, failed, _ in self.window if failed) / calls,
+                sum(1 for _, _, slow in self.window if slow) / calls)
+
+    def _move(self, state):
+        # Called with the lock held
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self.state = state
+        metrics.set_gauge(f'circuit.{self.name}.state', state)
+        metrics.incr(f'circuit.{self.name}.{state}')
+        logger.warning("Circuit for %s is now %s", self.name, state)
+
+    def describe(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            error_rate, slow_rate = self._rates()
+            return {
+                'state': self.state,
+                'calls_in_window': len(self.window),
+                'error_rate': round(error_rate, 3),
+                'slow_rate': round(slow_rate, 3),
+                'open_for_seconds': round(time.monotonic() - self.opened_at, 1) if self.state == OPEN else None,
+            }
+
+
+# <------------------------------------------------ Breaker registry ------------------------------------------------>
+
+# One breaker per vendor endpoint; calls to other URLs (file downloads, task polling) go without one.
+# State is per gunicorn worker, like the metrics.
+ENDPOINT_URLS = {
+    'idfy_aadhaar': AADHAR_URL,
+    'idfy_pancard': PANCARD_URL,
+    'idfy_profile': PROFILE_URL,
+    'bharat_otp_send': AADHAAR_OTP_SENT_URL,
+    'bharat_otp_submit': AADHAAR_OTP_SUBMIT_URL,
+    'bharat_pan': BHARAT_PAN_VERIFY_URL,
+    'bharat_bank_send': BANK_ACCOUNT_PENNYDROP_SEND_URL,
+    'bharat_bank_status': BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL,
+    'bharat_bank_pennyless': BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS,
+    'agent_code': AGENT_CODE_AUTO_URL,
+}
+BREAKERS = {name: CircuitBreaker(name) for name in ENDPOINT_URLS}
+_by_url = {url: BREAKERS[name] for name, url in ENDPOINT_URLS.items() if url}
+
+# Routes that can't answer without the endpoint; they get a 503 up front while its breaker is open
+ROUTE_ENDPOINTS = {
+    'aadharcard': 'idfy_aadhaar',
+    'pancard.pancard_document': 'idfy_pancard',
+    'profile.generate_video_link': 'idfy_profile',
+    'bharat.send_otp': 'bharat_otp_send',
+    'bharat.submit_verify_otp': 'bharat_otp_submit',
+    'bharat.verify_pan': 'bharat_pan',
+    'bharat.bank_account_send_request': 'bharat_bank_send',
+    'bharat.bank_account_get_status': 'bharat_bank_status',
+    'bharat.verify_bank_account': 'bharat_bank_pennyless',
+}
+
+
+def breaker_for_url(url):
+    return _by_url.get(url)
+
+
+def breaker_states():
+    return {name: breaker.describe() for name, breaker in BREAKERS.items()}
+
+
+def circuit_open_response(name, retry_after):
+    response = jsonify({"error": f"Upstream {name} is unavailable, retry later", "retry_after": retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def reject_while_open():
+    # before_request hook: fail fast instead of waiting out the vendor timeout
+    name = ROUTE_ENDPOINTS.get(request.endpoint)
+    if name is None:
+        return None
+    retry_after = BREAKERS[name].retry_after()
+    if retry_after:
+        metrics.incr(f'circuit.{name}.fast_failed')
+        return circuit_open_response(name, retry_after)
+    return None
@@ -0,0 +1,110 @@
+import os
+import logging
+import threading
+
+import boto3
+from botocore.config import Config
+from pymongo import MongoClient
+
+from config import (AWS_ACCESS_KEY_ID, AWS_S3_BUCKET_NAME, AWS_SECRET_ACCESS_KEY, DB_CLIENT, MONGO_CONNECT_TIMEOUT_MS, MONGO_MAX_POOL_SIZE,
+                    MONGO_MIN_POOL_SIZE, MONGO_URI, MONGO_SERVER_SELECTION_TIMEOUT_MS, S3_MAX_POOL_CONNECTIONS)
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ Per-worker client registry ------------------------------------------------>
+
+# MongoClient and boto3 clients own sockets and monitor threads that don't survive fork; each
+# gunicorn worker builds its own on first use (or in the post_fork hook, see gunicorn.conf.py).
+_lock = threading.Lock()
+_clients = {'pid': None, 'mongo': None, 's3': None}
+
+
+def _registry():
+    pid = os.getpid()
+    if _clients['pid'] != pid:
+        with _lock:
+            if _clients['pid'] != pid:
+                # Whatever the parent built is unusable here; drop the references without closing
+                # them, closing would touch the parent's sockets
+                _clients.update({'pid': pid, 'mongo': None, 's3': None})
+    return _clients
+
+
+def get_mongo_client():
+    clients = _registry()
+    if clients['mongo'] is None:
+        with _lock:
+            if clients['mongo'] is None:
+                clients['mongo'] = MongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE,
+                                               connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                                               serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS)
+                metrics.incr('clients.mongo.created')
+    return clients['mongo']
+
+
+def get_s3_client():
+    clients = _registry()
+    if clients['s3'] is None:
+        with _lock:
+            if clients['s3'] is None:
+                # One client for every upload; its pool has to cover archive workers * parts in flight
+                clients['s3'] = boto3.client('s3', aws_access_key_id = AWS_ACCESS_KEY_ID, aws_secret_access_key = AWS_SECRET_ACCESS_KEY,
+                                             config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={'mode': 'standard'}))
+                metrics.incr('clients.s3.created')
+    return clients['s3']
+
+
+class LazyDatabase:
+    """
+    Stand-in for the module-level Database, resolved against this worker's client on use.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_mongo_client()[DB_CLIENT], name)
+
+    def __getitem__(self, name):
+        return get_mongo_client()[DB_CLIENT][name]
+
+
+class LazyCollection:
+    """
+    Stand-in for a module-level Collection: `FIN_AADHAR.find_one(...)` keeps working, the
+    client behind it is the current worker's.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_mongo_client()[DB_CLIENT][self.name], attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
+
+# <------------------------------------------------ Warm-up ------------------------------------------------>
+
+def warm_up_clients():
+    """
+    Open connections before the worker takes traffic: Mongo (ping, then minPoolSize sockets
+    fill in the background), S3, the vendor HTTP sessions and the PostgreSQL log pool.
+    Failures are logged, a worker still starts with a cold client.
+    """
+    from aadhar.db_logging import warm_up_pool
+    from aadhar.http_client import UPSTREAM_TIMEOUTS, get_session
+
+    steps = [
+        ('mongo', lambda: get_mongo_client().admin.command('ping')),
+        ('s3', lambda: get_s3_client().head_bucket(Bucket=AWS_S3_BUCKET_NAME)),
+        ('http', lambda: [get_session(upstream) for upstream in UPSTREAM_TIMEOUTS]),
+        ('postgres', warm_up_pool),
+    ]
+    for name, step in steps:
+        try:
+            step()
+            metrics.incr(f'clients.{name}.warmed')
+        except Exception as e:
+            metrics.incr(f'clients.{name}.warm_up_failed')
+            logger.warning("Warm-up of %s client failed: %s", name, e)
@@ -1,9 +1,20 @@
-import psycopg2
+import io
+import os
+import csv
 import json
+import time
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+
+import psycopg2
 import pytz
+from psycopg2 import pool as pg_pool
 
-from config import POSTGRESQL_LOG_DATABASE, POSTGRESQL_LOG_HOST, POSTGRESQL_LOG_PASSWORD, POSTGRESQL_LOG_PORT, POSTGRESQL_LOG_USERNAME
+from config import (POSTGRESQL_LOG_DATABASE, POSTGRESQL_LOG_HOST, POSTGRESQL_LOG_PASSWORD, POSTGRESQL_LOG_PORT, POSTGRESQL_LOG_USERNAME,
+                    POSTGRESQL_LOG_POOL_MIN, POSTGRESQL_LOG_POOL_MAX, POSTGRESQL_LOG_POOL_TIMEOUT, POSTGRESQL_LOG_CONNECT_TIMEOUT,
+                    POSTGRESQL_LOG_HEALTHCHECK_SECONDS)
+from aadhar import metrics
 
 username = POSTGRESQL_LOG_USERNAME
 password = POSTGRESQL_LOG_PASSWORD
@@ -14,51 +25,168 @@ database = POSTGRESQL_LOG_DATABASE
 
 ist_timezone = pytz.timezone('Asia/Kolkata')
 
-def database_logging(message=None, event_type=None, additional_context=None):
+
+class LogPoolTimeout(Exception):
+    pass
+
+
+# Errors meaning the log database can't be reached, as opposed to a rejected row
+LOG_DB_UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, pg_pool.PoolError, LogPoolTimeout)
+
+
+# <------------------------------------------------ Per-worker connection pool ------------------------------------------------>
+
+# One pool per process. A pool inherited through gunicorn's fork is dropped without closing it,
+# closing would shut the sockets the parent (or a sibling worker) is still using.
+_pool_lock = threading.Lock()
+_pool_state = {'pid': None, 'pool': None, 'slots': None, 'last_used': {}}
+
+
+def _get_pool_state():
+    pid = os.getpid()
+    if _pool_state['pid'] == pid:
+        return _pool_state
+
+    with _pool_lock:
+        if _pool_state['pid'] != pid:
+            # psycopg2 opens minconn connections up front and closes returned ones beyond it, so
+            # POSTGRESQL_LOG_POOL_MIN is also the number of connections kept idle
+            log_pool = pg_pool.ThreadedConnectionPool(
+                POSTGRESQL_LOG_POOL_MIN,
+                POSTGRESQL_LOG_POOL_MAX,
+                host=hostname,
+                port=port,
+                database=database,
+                user=username,
+                password=password,
+                connect_timeout=POSTGRESQL_LOG_CONNECT_TIMEOUT,
+            )
+            _pool_state['pool'] = log_pool
+            # ThreadedConnectionPool raises instead of waiting when exhausted, the semaphore makes callers queue
+            _pool_state['slots'] = threading.BoundedSemaphore(POSTGRESQL_LOG_POOL_MAX)
+            _pool_state['last_used'] = {}
+            _pool_state['pid'] = pid
+            metrics.incr('pg_log_pool.created')
+    return _pool_state
+
+
+def _connection_alive(conn, last_used):
+    if conn.closed:
+        return False
+    if time.monotonic() - last_used < POSTGRESQL_LOG_HEALTHCHECK_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def warm_up_pool():
+    # Creating the pool opens POSTGRESQL_LOG_POOL_MIN connections
+    _get_pool_state()
+
+
+@contextmanager
+def log_connection():
     """
-    Logs an event to the ccaveunelogging PostgreSQL table.
-    
-    :param message: Log message
-    :param event_type: Route or event type
-    :param additional_context: Dictionary of additional data
+    Check a connection out of the worker's pool and give it back afterwards.
+    Broken connections are discarded instead of returned, the next checkout reconnects.
     """
+    state = _get_pool_state()
+    started = time.monotonic()
+
+    if not state['slots'].acquire(blocking=False):
+        metrics.incr('pg_log_pool.waits')
+        if not state['slots'].acquire(timeout=POSTGRESQL_LOG_POOL_TIMEOUT):
+            metrics.incr('pg_log_pool.timeouts')
+            raise LogPoolTimeout("Timed out waiting for a PostgreSQL log connection")
+
     conn = None
-    cur = None
+    broken = False
     try:
-        conn = psycopg2.connect(
-            host=hostname,
-            port=port,
-            database=database,
-            user=username,
-            password=password
-        )
-        cur = conn.cursor()
-
-        insert_query = """
-            INSERT INTO public.idfy_logging (api_route, message, data, data_received_time)
-            VALUES (%s, %s, %s, %s)
-        """
-
-        api_route = event_type
-        log_message = message
-        data = additional_context or {}
-        data_received_time = datetime.now(ist_timezone).strftime('%Y-%m-%dT%H:%M:%S%z')
-
-        cur.execute(insert_query, (
-            api_route,
-            log_message,
-            json.dumps(data),
-            data_received_time
-        ))
-
-        conn.commit()
-
-    except Exception:
-        conn.rollback()
+        conn = state['pool'].getconn()
+        if not _connection_alive(conn, state['last_used'].get(id(conn), 0)):
+            metrics.incr('pg_log_pool.reconnects')
+            state['last_used'].pop(id(conn), None)
+            state['pool'].putconn(conn, close=True)
+            # Already back in the pool; if the next getconn fails, finally must not return it twice
+            conn = None
+            conn = state['pool'].getconn()
+        metrics.observe('pg_log_pool.checkout', time.monotonic() - started)
+
+        yield conn
+
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
 
     finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+        try:
+            if conn is not None:
+                if broken or conn.closed:
+                    state['last_used'].pop(id(conn), None)
+                else:
+                    state['last_used'][id(conn)] = time.monotonic()
+                state['pool'].putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            # A failing putconn must not leak the slot, or checkouts eventually all time out
+            state['slots'].release()
+
+
+def ping_log_db():
+    with log_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+    return True
+
+
+# <------------------------------------------------ Log rows ------------------------------------------------>
+
+LOG_COLUMNS = ('api_route', 'message', 'data', 'data_received_time')
+
+
+def build_log_row(message=None, event_type=None, additional_context=None):
+    log_message = message if message is None or isinstance(message, str) else str(message)
+    data = json.dumps(additional_context or {}, default=str)
+    # ISO text so the row survives the CSV/JSON round trips; PostgreSQL parses it into the timestamptz column
+    data_received_time = datetime.now(ist_timezone).isoformat()
+    return (event_type, log_message, data, data_received_time)
+
+
+def copy_log_rows(rows):
+    """
+    Bulk load rows built by build_log_row with a single COPY.
+    If PostgreSQL rejects the batch because of the data, the rows are inserted one by one
+    so a single bad row does not take the rest of the batch with it.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    with log_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(
+                    f"COPY public.idfy_logging ({', '.join(LOG_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            conn.commit()
+            return len(rows)
+
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            conn.rollback()
 
+        written = 0
+        insert_query = f"INSERT INTO public.idfy_logging ({', '.join(LOG_COLUMNS)}) VALUES (%s, %s, %s, %s)"
+        for row in rows:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(insert_query, row)
+                conn.commit()
+                written += 1
+            except (psycopg2.DataError, psycopg2.IntegrityError):
+                conn.rollback()
+                metrics.incr('pg_log.rejected_rows')
+        return written
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (HTTP_CONNECT_TIMEOUT, HTTP_FILE_READ_TIMEOUT, HTTP_GET_RETRIES, HTTP_POOL_MAXSIZE, HTTP_READ_TIMEOUT, HTTP_RETRY_BACKOFF,
+                    IDFY_STATUS_READ_TIMEOUT)
+from aadhar import metrics
+from aadhar.circuit_breaker import breaker_for_url
+
+
+# <------------------------------------------------ Pooled vendor sessions ------------------------------------------------>
+
+# (connect, read) timeouts per upstream; idfy_files downloads KYC videos so it gets a longer read timeout,
+# idfy_status is the shared poller's status check and gets a short one
+UPSTREAM_TIMEOUTS = {
+    'idfy': (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    'idfy_status': (HTTP_CONNECT_TIMEOUT, IDFY_STATUS_READ_TIMEOUT),
+    'idfy_files': (HTTP_CONNECT_TIMEOUT, HTTP_FILE_READ_TIMEOUT),
+    'bharat': (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    'agent_code': (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+}
+
+# Upstreams whose GETs are not retried by urllib3
+NO_RETRY_UPSTREAMS = {'idfy_status'}
+
+_lock = threading.Lock()
+_sessions = {'pid': None, 'by_upstream': {}}
+
+
+def _build_session(retries=HTTP_GET_RETRIES):
+    # Only idempotent methods are retried on read errors and 5xx; connect errors are retried for
+    # every method since the request never reached the vendor
+    retry = Retry(
+        total=retries,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(upstream):
+    pid = os.getpid()
+    if _sessions['pid'] != pid or upstream not in _sessions['by_upstream']:
+        with _lock:
+            if _sessions['pid'] != pid:
+                # Keep-alive sockets inherited through fork are shared with the parent, start clean
+                _sessions['by_upstream'] = {}
+                _sessions['pid'] = pid
+            if upstream not in _sessions['by_upstream']:
+                _sessions['by_upstream'][upstream] = _build_session(0 if upstream in NO_RETRY_UPSTREAMS else HTTP_GET_RETRIES)
+    return _sessions['by_upstream'][upstream]
+
+
+def vendor_request(upstream, method, url, **kwargs):
+    kwargs.setdefault('timeout', UPSTREAM_TIMEOUTS.get(upstream, (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)))
+
+    # Raises CircuitOpenError without touching the network while the endpoint's breaker is open
+    breaker = breaker_for_url(url)
+    if breaker is not None:
+        breaker.before_call()
+
+    started = time.monotonic()
+    failed = True
+    try:
+        response = get_session(upstream).request(method, url, **kwargs)
+        failed = response.status_code >= 500
+        return response
+    except requests.RequestException:
+        metrics.incr(f'http.{upstream}.errors')
+        raise
+    finally:
+        seconds = time.monotonic() - started
+        if breaker is not None:
+            breaker.after_call(failed, seconds)
+        metrics.incr(f'http.{upstream}.requests')
+        metrics.observe(f'http.{upstream}', seconds)
@@ -0,0 +1,108 @@
+import hmac
+import hashlib
+from functools import wraps
+from datetime import datetime, timedelta, timezone
+
+from flask import jsonify, make_response, request
+from pymongo.errors import DuplicateKeyError
+
+from config import IDEMPOTENCY_LEASE_SECONDS, IDEMPOTENCY_TTL_SECONDS
+from aadhar import metrics
+from aadhar.utils import aes_decrypt, aes_encrypt, derive_hmac_key
+
+_hmac_key = derive_hmac_key('idempotency-key')
+
+# Request headers that change what the endpoint does, part of the request fingerprint
+FINGERPRINT_HEADERS = ('Aadhar-no', 'Prefer')
+# Response headers replayed along with the body
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'Preference-Applied')
+
+
+# <------------------------------------------------ Idempotency-Key ------------------------------------------------>
+
+def _digest(*parts):
+    return hmac.new(_hmac_key, b'|'.join(parts), hashlib.sha256).hexdigest()
+
+
+def _fingerprint():
+    headers = [request.headers.get(name, '').encode() for name in FINGERPRINT_HEADERS]
+    return _digest(request.path.encode(), request.get_data(), *headers)
+
+
+def _replay(record):
+    response = make_response(aes_decrypt(record['body']), record['status_code'])
+    for name, value in record.get('headers', {}).items():
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(collection, key, fingerprint):
+    # Returns None when this request owns the key, else the stored record
+    now = datetime.now(timezone.utc)
+    processing = {'status': 'processing', 'fingerprint': fingerprint, 'lease_until': now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+                  'created_at': now, 'expires_at': now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)}
+    try:
+        collection.insert_one(dict(processing, _id=key))
+        return None
+    except DuplicateKeyError:
+        pass
+
+    # The first attempt died mid-flight; this retry runs it again
+    taken = collection.find_one_and_update({'_id': key, 'status': 'processing', 'fingerprint': fingerprint, 'lease_until': {'$lt': now}},
+                                           {'$set': processing})
+    if taken:
+        return None
+    return collection.find_one({'_id': key}) or {'status': 'processing', 'fingerprint': fingerprint}
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header: the first request with a key runs, its response is
+    stored and replayed to retries with the same key and body for IDEMPOTENCY_TTL_SECONDS.
+    5xx responses are not stored, a retry runs again.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from aadhar.aadhar import IDEMPOTENCY_KEYS
+
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return view(*args, **kwargs)
+
+        key = _digest(request.endpoint.encode(), idempotency_key.encode())
+        fingerprint = _fingerprint()
+        record = _claim(IDEMPOTENCY_KEYS, key, fingerprint)
+        if record is not None:
+            if record['fingerprint'] != fingerprint:
+                metrics.incr('idempotency.mismatch')
+                return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+            if record['status'] == 'processing':
+                metrics.incr('idempotency.in_progress')
+                response = make_response(jsonify({"error": "A request with this Idempotency-Key is still being processed"}), 409)
+                response.headers['Retry-After'] = '1'
+                return response
+            metrics.incr('idempotency.replayed')
+            return _replay(record)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            IDEMPOTENCY_KEYS.delete_one({'_id': key})
+            raise
+
+        if response.status_code >= 500:
+            IDEMPOTENCY_KEYS.delete_one({'_id': key})
+            return response
+
+        IDEMPOTENCY_KEYS.update_one({'_id': key}, {'$set': {
+            'status': 'completed',
+            'status_code': response.status_code,
+            # Bodies can carry decrypted PAN/Aadhaar data
+            'body': aes_encrypt(response.get_data(as_text=True)),
+            'headers': {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers},
+        }, '$unset': {'lease_until': ''}})
+        metrics.incr('idempotency.stored')
+        return response
+
+    return wrapper
@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from config import IDFY_POLL_COALESCE, IDFY_POLL_CONCURRENCY, REQUEST_SEND_URL
+from aadhar import metrics
+from aadhar.poll_schedule import clip_to_deadline, first_delay, next_delay, record_completion
+from aadhar.task_events import start_task_event_listener
+
+logger = logging.getLogger(__name__)
+
+TIMED_OUT = object()
+
+
+# <------------------------------------------------ Shared IDfy status poller ------------------------------------------------>
+
+class IdfyPoller:
+    """
+    One status loop per worker for every outstanding IDfy request_id. Each id carries its own
+    adaptive schedule (see aadhar.poll_schedule); ids falling due within IDFY_POLL_COALESCE of
+    each other are checked in the same tick, and every caller waiting on an id is woken once
+    IDfy stops reporting in_progress.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.watched = {}   # request_id -> {'headers', 'task_type', 'futures', 'started', 'deadline', 'delay', 'next_check'}
+        self.fetcher = ThreadPoolExecutor(max_workers=IDFY_POLL_CONCURRENCY, thread_name_prefix='idfy-poll')
+        self.thread = threading.Thread(target=self._run, name='idfy-poller', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def watch(self, request_id, headers, task_type, timeout):
+        future = Future()
+        now = time.monotonic()
+        with self.condition:
+            entry = self.watched.get(request_id)
+            if entry is None:
+                delay = first_delay(task_type)
+                entry = self.watched[request_id] = {
+                    'headers': headers,
+                    'task_type': task_type,
+                    'futures': [],
+                    'started': now,
+                    'deadline': now + timeout,
+                    'delay': delay,
+                    'next_check': now + clip_to_deadline(now, delay, now + timeout),
+                }
+            entry['deadline'] = max(entry['deadline'], now + timeout)
+            entry['futures'].append(future)
+            metrics.set_gauge('idfy_poller.watched', len(self.watched))
+            self.condition.notify()
+        return future
+
+    def unwatch(self, request_id, future):
+        with self.condition:
+            entry = self.watched.get(request_id)
+            if entry and future in entry['futures']:
+                entry['futures'].remove(future)
+                if not entry['futures']:
+                    del self.watched[request_id]
+            metrics.set_gauge('idfy_poller.watched', len(self.watched))
+
+    def wake(self, request_id):
+        # IDfy called back about request_id: check its status now instead of at the next scheduled time.
+        # The callback itself is unauthenticated, the result always comes from the status API.
+        with self.condition:
+            entry = self.watched.get(request_id)
+            if entry is None or entry['next_check'] == float('inf'):
+                return
+            entry['next_check'] = time.monotonic()
+            metrics.incr('idfy_poller.woken_by_callback')
+            self.condition.notify()
+
+    def _resolve(self, request_id, response_data):
+        with self.condition:
+            entry = self.watched.pop(request_id, None)
+            metrics.set_gauge('idfy_poller.watched', len(self.watched))
+        if not entry:
+            return
+
+        if _status(response_data) == 'completed':
+            record_completion(entry['task_type'], time.monotonic() - entry['started'])
+        for future in entry['futures']:
+            if not future.done():
+                future.set_result(response_data)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.watched:
+                        self.condition.wait()
+                        continue
+                    next_check = min(entry['next_check'] for entry in self.watched.values())
+                    if next_check == float('inf'):
+                        # Every id has a status call out; _reschedule notifies when one is due again
+                        self.condition.wait()
+                        continue
+                    wait = next_check - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+
+            try:
+                self._tick()
+            except Exception as e:
+                metrics.incr('idfy_poller.errors')
+                logger.error("IDfy poller tick failed: %s", e)
+
+    def _tick(self):
+        horizon = time.monotonic() + IDFY_POLL_COALESCE
+        with self.condition:
+            due = []
+            for request_id, entry in self.watched.items():
+                if entry['next_check'] <= horizon:
+                    # Out of the schedule until its status call comes back (see _reschedule)
+                    entry['next_check'] = float('inf')
+                    due.append((request_id, entry['headers'], len(entry['futures'])))
+        if not due:
+            return
+
+        from aadhar.idfy_utils import make_idfy_request
+
+        # Each status call settles its own waiters as soon as it returns; a slow one holds up nobody else
+        for request_id, headers, waiters in due:
+            future = self.fetcher.submit(make_idfy_request, REQUEST_SEND_URL, headers, {'request_id': request_id}, upstream='idfy_status')
+            future.add_done_callback(lambda future, request_id=request_id, waiters=waiters, started=time.monotonic():
+                                     self._checked(request_id, waiters, started, future))
+
+        metrics.incr('idfy_poller.ticks')
+        metrics.incr('idfy_poller.status_calls', len(due))
+
+    def _checked(self, request_id, waiters, started, future):
+        metrics.observe('idfy_poller.status_call', time.monotonic() - started)
+        # One status call served every caller waiting on this request_id
+        metrics.incr('idfy_poller.calls_saved', waiters - 1)
+        try:
+            response_data = future.result()
+        except Exception as e:
+            metrics.incr('idfy_poller.errors')
+            logger.error("IDfy status call for %s failed: %s", request_id, e)
+            response_data = None
+
+        if _status(response_data) == 'in_progress' or response_data is None:
+            self._reschedule(request_id)
+            return
+        self._resolve(request_id, response_data)
+
+    def _reschedule(self, request_id):
+        now = time.monotonic()
+        with self.condition:
+            entry = self.watched.get(request_id)
+            if entry is None:
+                return
+            if now >= entry['deadline']:
+                # Every waiter has given up (or is about to); stop spending calls on it
+                del self.watched[request_id]
+                return
+            entry['delay'] = next_delay(entry['delay'])
+            entry['next_check'] = now + clip_to_deadline(now, entry['delay'], entry['deadline'])
+            self.condition.notify()
+
+
+def _status(response_data):
+    if isinstance(response_data, list) and response_data:
+        return response_data[0].get('status')
+    return None
+
+
+_poller_lock = threading.Lock()
+_poller_state = {'pid': None, 'poller': None}
+
+
+def get_poller():
+    pid = os.getpid()
+    if _poller_state['pid'] != pid:
+        with _poller_lock:
+            if _poller_state['pid'] != pid:
+                _poller_state['poller'] = IdfyPoller().start()
+                _poller_state['pid'] = pid
+                start_task_event_listener()
+    return _poller_state['poller']
+
+
+def wait_for_idfy_task(request_id, headers, task_type, timeout):
+    """
+    Block until IDfy reports the task as anything but in_progress and return the raw status
+    response (None or an error dict when the status call failed), or TIMED_OUT once the
+    timeout budget is spent.
+    """
+    poller = get_poller()
+    future = poller.watch(request_id, headers, task_type, timeout)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        poller.unwatch(request_id, future)
+        return TIMED_OUT
@@ -0,0 +1,231 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, jsonify, request
+from pymongo import ReturnDocument
+
+from config import FIN_ACCOUNT_ID, FIN_API_KEY, IDFY_ASYNC_MODE, IDFY_ASYNC_WORKERS, IDFY_TASK_LEASE_SECONDS
+from aadhar.log import log_data
+from aadhar.utils import added_time, aes_decrypt, aes_encrypt
+from aadhar.idfy_utils import check_aadhaar_card_status, check_pan_card_status
+
+
+# Create a Blueprint instance
+task_bp = Blueprint('idfy_task', __name__)
+
+
+# <------------------------------------------------ Async IDfy tasks ------------------------------------------------>
+
+_executor_lock = threading.Lock()
+_executor_state = {'pid': None, 'executor': None}
+
+
+def _executor():
+    pid = os.getpid()
+    if _executor_state['pid'] != pid:
+        with _executor_lock:
+            if _executor_state['pid'] != pid:
+                _executor_state['executor'] = ThreadPoolExecutor(max_workers=IDFY_ASYNC_WORKERS, thread_name_prefix='idfy-task')
+                _executor_state['pid'] = pid
+    return _executor_state['executor']
+
+
+def _lease_until():
+    return datetime.now(timezone.utc) + timedelta(seconds=IDFY_TASK_LEASE_SECONDS)
+
+
+# Tasks this worker holds the lease of, queued or running: request_id -> owner token. The lease
+# keeper renews them, so a lease only runs out when the worker that took the task is gone.
+_owned_lock = threading.Lock()
+_owned = {}
+_keeper_state = {'pid': None}
+
+
+def _keep_leases():
+    from aadhar.aadhar import IDFY_TASKS
+
+    while True:
+        time.sleep(IDFY_TASK_LEASE_SECONDS / 3)
+        with _owned_lock:
+            owned = list(_owned.items())
+        for request_id, owner in owned:
+            try:
+                IDFY_TASKS.update_one({'request_id': request_id, 'status': 'in_progress', 'owner': owner},
+                                      {'$set': {'lease_until': _lease_until()}})
+            except Exception as e:
+                log_data(message=f"Failed to renew IDfy task lease: {e}", event_type='/idfy/task', log_level=logging.ERROR,
+                         additional_context={'request_id': request_id})
+
+
+def _submit(task_type, request_id, reference_id, request_data, owner):
+    with _owned_lock:
+        _owned[request_id] = owner
+        if _keeper_state['pid'] != os.getpid():
+            _keeper_state['pid'] = os.getpid()
+            threading.Thread(target=_keep_leases, name='idfy-task-lease-keeper', daemon=True).start()
+    _executor().submit(complete_task, task_type, request_id, reference_id, request_data, owner)
+
+
+def _idfy_headers():
+    return {
+        'account-id': FIN_ACCOUNT_ID,
+        'api-key': FIN_API_KEY,
+        'Content-Type': 'application/json',
+    }
+
+
+def wants_async():
+    return IDFY_ASYNC_MODE or 'respond-async' in request.headers.get('Prefer', '').lower()
+
+
+def accept_task(task_type, request_id, reference_id=None, request_data=None):
+    """
+    Record an IDfy task as in progress, finish it on the background pool and answer 202.
+    """
+    from aadhar.aadhar import IDFY_TASKS
+
+    owner = uuid.uuid4().hex
+    stored_request_data = dict(request_data) if request_data else None
+    if stored_request_data and stored_request_data.get('pan_number'):
+        stored_request_data['pan_number'] = aes_encrypt(stored_request_data['pan_number'])
+
+    IDFY_TASKS.insert_one({
+        'request_id': request_id,
+        'task_type': task_type,
+        'reference_id': reference_id,
+        'request_data': stored_request_data,
+        'status': 'in_progress',
+        'created_time': added_time(),
+        'owner': owner,
+        'lease_until': _lease_until(),
+    })
+    _submit(task_type, request_id, reference_id, request_data, owner)
+
+    log_data(message="IDfy task accepted for background completion", event_type='/idfy/task', log_level=logging.INFO,
+             additional_context={'request_id': request_id, 'task_type': task_type})
+
+    response = jsonify({"request_id": request_id, "status": "in_progress", "status_url": f"/idfy/task/{request_id}"})
+    response.headers['Location'] = f"/idfy/task/{request_id}"
+    response.headers['Preference-Applied'] = 'respond-async'
+    return response, 202
+
+
+def complete_task(task_type, request_id, reference_id, request_data, owner):
+    from aadhar.aadhar import FIN_AADHAR, IDFY_TASKS
+
+    def finish(body, status_code):
+        # Only the current owner of an in-progress task records its result; False when someone else did
+        return IDFY_TASKS.update_one({'request_id': request_id, 'status': 'in_progress', 'owner': owner}, {'$set': {
+            'status': 'completed' if status_code == 200 else 'failed',
+            'result': body,
+            'status_code': status_code,
+            'completed_time': added_time(),
+        }, '$unset': {'lease_until': ''}}).modified_count == 1
+
+    try:
+        # The lease counts from here, not from when the task was queued
+        started = IDFY_TASKS.update_one({'request_id': request_id, 'status': 'in_progress', 'owner': owner},
+                                        {'$set': {'lease_until': _lease_until(), 'started_time': added_time()}})
+        if not started.matched_count:
+            return
+
+        finished = None
+        try:
+            if task_type == 'pan':
+                def claim_completion(response):
+                    nonlocal finished
+                    body = dict(response, input_pan_number=aes_encrypt(response['input_pan_number'])) if response.get('input_pan_number') else response
+                    finished = finish(body, 200)
+                    return finished
+
+                body, status_code = check_pan_card_status(request_id, _idfy_headers(), request_data, claim_completion=claim_completion)
+            else:
+                body, status_code = check_aadhaar_card_status(request_id, _idfy_headers())
+                if status_code == 200:
+                    FIN_AADHAR.update_one({'request_ref_id': reference_id},
+                                          {'$set': {'redirect_url': body.get('redirect_url'), 'idfy_request_id': request_id}}, upsert=True)
+
+        except Exception as e:
+            body, status_code = {"error": str(e)}, 500
+
+        if finished is None:
+            finished = finish(body, status_code)
+
+    finally:
+        with _owned_lock:
+            if _owned.get(request_id) == owner:
+                del _owned[request_id]
+
+    log_data(message="IDfy background task finished" if finished else "IDfy background task already finished elsewhere", event_type='/idfy/task',
+             log_level=logging.INFO if status_code == 200 else logging.ERROR,
+             additional_context={'request_id': request_id, 'task_type': task_type, 'status_code': status_code})
+
+
+def _resume_abandoned(task):
+    # The worker that owned the task died before finishing it; whoever wins the lease takes over
+    from aadhar.aadhar import IDFY_TASKS
+
+    owner = uuid.uuid4().hex
+    claimed = IDFY_TASKS.find_one_and_update(
+        {'request_id': task['request_id'], 'status': 'in_progress', 'lease_until': {'$lt': datetime.now(timezone.utc)}},
+        {'$set': {'owner': owner, 'lease_until': _lease_until()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed:
+        log_data(message="Resuming abandoned IDfy task", event_type='/idfy/task', log_level=logging.INFO,
+                 additional_context={'request_id': task['request_id']})
+        request_data = claimed.get('request_data')
+        if request_data and request_data.get('pan_number'):
+            request_data = dict(request_data, pan_number=aes_decrypt(request_data['pan_number']))
+        _submit(claimed['task_type'], claimed['request_id'], claimed.get('reference_id'), request_data, owner)
+
+
+@task_bp.route('/idfy/task/<request_id>', methods=['GET'])
+def idfy_task_status(request_id):
+    """
+    IDfy Async Task Status
+    ---
+    tags:
+      - IDfy Async Tasks
+    summary: Result of a /pancard or /aadharcard call made with "Prefer respond-async"
+    parameters:
+      - name: request_id
+        in: path
+        type: string
+        required: true
+        description: request_id returned with the 202 response
+    responses:
+      200:
+        description: Task finished, body is the same as the synchronous endpoint's
+      202:
+        description: Task still in progress
+      404:
+        description: Unknown request_id
+    """
+    from aadhar.aadhar import IDFY_TASKS
+
+    try:
+        task = IDFY_TASKS.find_one({'request_id': request_id},
+                                   {'_id': 0, 'request_id': 1, 'task_type': 1, 'status': 1, 'result': 1, 'status_code': 1, 'lease_until': 1})
+        if not task:
+            return jsonify({"error": "No IDfy task found for the provided request_id"}), 404
+
+        if task['status'] == 'in_progress':
+            lease_until = task.get('lease_until')
+            if lease_until and lease_until.replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
+                _resume_abandoned(task)
+            return jsonify({"request_id": request_id, "status": "in_progress"}), 202
+
+        result = task.get('result') or {}
+        if task['task_type'] == 'pan' and result.get('input_pan_number'):
+            result = dict(result, input_pan_number=aes_decrypt(result['input_pan_number']))
+        return jsonify(result), task.get('status_code', 200)
+
+    except Exception as e:
+        log_data(message=str(e), event_type='/idfy/task', log_level=logging.ERROR, additional_context={'request_id': request_id})
+        return jsonify({"error": str(e)}), 500
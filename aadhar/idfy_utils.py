@@ -1,22 +1,25 @@
 import os
-import time
 import logging
 import requests
 
+from aadhar.http_client import vendor_request
+from aadhar.circuit_breaker import CircuitOpenError
+from aadhar.idfy_poller import TIMED_OUT, wait_for_idfy_task
+from aadhar.pan_cache import pan_response, remember_pan_verification
 from aadhar.utils import added_time, aes_encrypt, generate_id
-from config import AADHAR_URL, AGENT_CODE_AUTO_URL, PANCARD_URL, PROFILE_URL, REQUEST_SEND_URL
+from config import AADHAR_URL, AGENT_CODE_AUTO_URL, IDFY_AADHAAR_DEADLINE, IDFY_PAN_DEADLINE, PANCARD_URL, PROFILE_URL
 from aadhar.log import log_data
 
 
 # <------------------------------------------------------------- IDfy API Call------------------------------------------------------------->
 
-def make_idfy_request(url, headers, data=None, method='GET'):
+def make_idfy_request(url, headers, data=None, method='GET', upstream='idfy'):
 
     try:
         if method == 'POST':
-            response = requests.post(url, headers=headers, json=data)
+            response = vendor_request(upstream, 'POST', url, headers=headers, json=data)
         elif method == 'GET':
-            response = requests.get(url, headers=headers, params=data)
+            response = vendor_request(upstream, 'GET', url, headers=headers, params=data)
         else:
             raise ValueError("Unsupported HTTP method")
         return response.json()
@@ -29,49 +32,53 @@ def make_idfy_request(url, headers, data=None, method='GET'):
 
 def fetch_aadhaar_card_data(headers, data):
 
+    request_id, error_response = start_aadhaar_task(headers, data)
+    if not request_id:
+        return error_response
+
+    return check_aadhaar_card_status(request_id, headers)
+
+
+# Submit the Digilocker task only, returns (request_id, None) or (None, error response)
+def start_aadhaar_task(headers, data):
+
     response_data = make_idfy_request(AADHAR_URL,headers, data, method='POST')
     log_data(message="Response data from IDFY aadhaar request id", event_type='/aadharcard', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': data, 'response_data': response_data})
 
-    request_id = response_data.get('request_id')
+    request_id = (response_data or {}).get('request_id')
     
     if not request_id:
         log_data(message ="Aadhaar get error from IDfy Redirect", event_type = '/aadharcard', log_level = logging.ERROR, 
                     additional_context = ({'request_data': data, "return_data" : {"error": "Failed to initiate Aadhaar card verification", "Response": response_data}}))
-        return {"error": "Failed to initiate Aadhaar card verification", "Response": response_data}, 500
+        return None, ({"error": "Failed to initiate Aadhaar card verification", "Response": response_data}, 500)
     
-    return check_aadhaar_card_status(request_id, headers, num_checks = 2)
-
-
-# Two time,s check and time different is 5 second's 
-def check_aadhaar_card_status(request_id, headers, num_checks, delay = 5):
-
-    for _ in range(num_checks):
-        time.sleep(delay)
-        response_data = make_idfy_request(REQUEST_SEND_URL, headers, {'request_id': request_id})
-        if not response_data or "error" in response_data:
-            log_data(message = "Failed to check aadhaar card status", event_type = '/aadharcard', log_level = logging.ERROR, 
-                     additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': {"Aadhaar_Error": response_data}}))
-            return {"error": "Failed to check aadhaar card status", "Response": response_data}, 500
-
-        if response_data:
-            log_data(message = f"IDFY aadhaar response after passed request id", event_type = '/aadharcard', log_level = logging.INFO, 
-                     additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': response_data}))
-            task = response_data[0]
-            if task.get('status') == 'completed':
-                return process_completed_aadhaar_task(task)
-            
-            elif task.get('status') == 'in_progress':
-                continue
-            
-            else:
-                log_data(message = f"Failed to fetch data - status : {task.get('status')}", event_type = '/aadharcard', log_level = logging.ERROR, 
-                         additional_context = ({'request_data': {'request_id': request_id}, 'return_data': {"Aadhaar_Error": response_data}}))
-                return {"error": f"Failed to fetch data - status : {task.get('status')}-- error: {task.get('error')}"}, 500
-    
-    log_data(message = "Reached maximum number of checks without completion", event_type = '/aadharcard', log_level = logging.ERROR, 
-             additional_context = ({'request_data': {'request_id': request_id}, 'return_data': {"error": "Reached maximum number of checks without completion"}}))
-    return {"error": "Reached maximum number of checks without completion"}, 500
+    return request_id, None
+
+
+# Wait on the shared poller until IDfy finishes or the deadline (seconds) is spent
+def check_aadhaar_card_status(request_id, headers, deadline = IDFY_AADHAAR_DEADLINE):
+
+    response_data = wait_for_idfy_task(request_id, headers, 'aadhaar', timeout = deadline)
+    if response_data is TIMED_OUT:
+        log_data(message = "Reached maximum number of checks without completion", event_type = '/aadharcard', log_level = logging.ERROR, 
+                 additional_context = ({'request_data': {'request_id': request_id}, 'return_data': {"error": "Reached maximum number of checks without completion"}}))
+        return {"error": "Reached maximum number of checks without completion"}, 500
+
+    if not response_data or "error" in response_data:
+        log_data(message = "Failed to check aadhaar card status", event_type = '/aadharcard', log_level = logging.ERROR, 
+                 additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': {"Aadhaar_Error": response_data}}))
+        return {"error": "Failed to check aadhaar card status", "Response": response_data}, 500
+
+    log_data(message = f"IDFY aadhaar response after passed request id", event_type = '/aadharcard', log_level = logging.INFO, 
+             additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': response_data}))
+    task = response_data[0]
+    if task.get('status') == 'completed':
+        return process_completed_aadhaar_task(task)
+
+    log_data(message = f"Failed to fetch data - status : {task.get('status')}", event_type = '/aadharcard', log_level = logging.ERROR, 
+             additional_context = ({'request_data': {'request_id': request_id}, 'return_data': {"Aadhaar_Error": response_data}}))
+    return {"error": f"Failed to fetch data - status : {task.get('status')}-- error: {task.get('error')}"}, 500
 
 
 def process_completed_aadhaar_task(task):
@@ -91,6 +98,16 @@ def process_completed_aadhaar_task(task):
 
 def fetch_pan_card_data(request_data, headers):
 
+    request_id, error_response = start_pan_task(request_data, headers)
+    if not request_id:
+        return error_response
+
+    return check_pan_card_status(request_id, headers, request_data)
+
+
+# Submit the PAN verification task only, returns (request_id, None) or (None, error response)
+def start_pan_task(request_data, headers):
+
     data = {
         "task_id":  generate_id(),
         "group_id":  generate_id(),
@@ -106,48 +123,41 @@ def fetch_pan_card_data(request_data, headers):
     log_data(message="Response data from IDFY Pan verify", event_type='/pancard', log_level=logging.INFO, 
                  additional_context = {'payload_data_json': data, 'response_data': response_data})
 
-    request_id = response_data.get('request_id')
+    request_id = (response_data or {}).get('request_id')
     if not request_id:
         log_data(message ="Pan data missing request id", event_type = '/pancard', log_level = logging.ERROR, 
                  additional_context = ({'request_data': request_data, 'return_data': {"error": "Failed to initiate PAN card verification", "Response": response_data}}))
-        return {"error": "Failed to initiate PAN card verification", "Response": response_data}, 500
+        return None, ({"error": "Failed to initiate PAN card verification", "Response": response_data}, 500)
 
-    return check_pan_card_status(request_id, headers, request_data, num_checks = 5, )
+    return request_id, None
 
 
-# Two time,s check and time different is 5 second's
-def check_pan_card_status(request_id, headers, request_data, num_checks, delay = 5):
+# Wait on the shared poller until IDfy finishes or the deadline (seconds) is spent
+def check_pan_card_status(request_id, headers, request_data, deadline = IDFY_PAN_DEADLINE, claim_completion = None):
 
-    for _ in range(num_checks):
-        time.sleep(delay)
-        response_data = make_idfy_request(REQUEST_SEND_URL, headers, {'request_id': request_id})
-        log_data(message = f"IDFY Pan response after passed request id", event_type = '/pancard', log_level = logging.INFO, 
-                     additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': response_data}))
+    response_data = wait_for_idfy_task(request_id, headers, 'pan', timeout = deadline)
+    if response_data is TIMED_OUT:
+        log_data(message = "Reached maximum number of checks without completion", event_type = '/pancard', log_level = logging.ERROR, 
+                    additional_context = ({'request_data': request_data, 'return_data': {"error": "Reached maximum number of checks without completion"}}))
+        return {"error": "Reached maximum number of checks without completion"}, 500
 
-        if not response_data or "error" in response_data:
-            return {"error": "Failed to check PAN card status", "Response": response_data}, 500
+    log_data(message = f"IDFY Pan response after passed request id", event_type = '/pancard', log_level = logging.INFO, 
+                 additional_context = ({'payload_data_json': {'request_id': request_id}, 'response_data': response_data}))
 
-        if response_data:
-            task = response_data[0]
+    if not response_data or "error" in response_data:
+        return {"error": "Failed to check PAN card status", "Response": response_data}, 500
 
-            if task.get('status') == 'completed':
-                return process_completed_pancard_task(task, request_data)
-            
-            elif task.get('status') == 'in_progress':
-                continue
-           
-            else:
-                log_data(message=f"IDfy Pan card request failed :{task.get('status')}", event_type='pancard',
-                         log_level=logging.ERROR, additional_context = ({'request_data': request_data, 'return_data': {"error": f"Failed to fetch data,  status :{task.get('status')}"}}))
-                return {"error": f"Failed to fetch data,  status :{task.get('status')}"}, 500
-            
-    log_data(message = "Reached maximum number of checks without completion", event_type = '/pancard', log_level = logging.ERROR, 
-                additional_context = ({'request_data': request_data, 'return_data': {"error": "Reached maximum number of checks without completion"}}))
-    return {"error": "Reached maximum number of checks without completion"}, 500
+    task = response_data[0]
+    if task.get('status') == 'completed':
+        return process_completed_pancard_task(task, request_data, claim_completion)
+
+    log_data(message=f"IDfy Pan card request failed :{task.get('status')}", event_type='pancard',
+             log_level=logging.ERROR, additional_context = ({'request_data': request_data, 'return_data': {"error": f"Failed to fetch data,  status :{task.get('status')}"}}))
+    return {"error": f"Failed to fetch data,  status :{task.get('status')}"}, 500
 
 
-# Complete the status after serlizer
-def process_completed_pancard_task(task, request_data):
+# Complete the status after serlizer; claim_completion(response) -> bool lets an async task store the result only once
+def process_completed_pancard_task(task, request_data, claim_completion = None):
     from aadhar.aadhar import PANCARD_DATA
 
     task['recieved_data_time'] = added_time()
@@ -158,20 +168,19 @@ def process_completed_pancard_task(task, request_data):
 
     encrypted_pan_number = aes_encrypt(input_pan_number)
     input_details['input_pan_number'] = encrypted_pan_number    
+    response = pan_response(task, input_pan_number)
+    if claim_completion is not None and not claim_completion(response):
+        log_data(message = "IDfy pan task already completed elsewhere", event_type = '/pancard', log_level=logging.INFO,
+                 additional_context = {'request_id': task.get('request_id')})
+        return response, 200
+
+    remember_pan_verification(task, request_data, response)
     PANCARD_DATA.insert_one(task)
 
     log_data(message = "IDFY pan card data received", event_type = '/pancard',log_level=logging.INFO,
              additional_context = {'request_data':  request_data, 'return_data': task})
     
-    return {
-        "status" : task.get('status'),
-        "pan_status": source_output.get('pan_status'),
-        "dob_match": source_output.get('dob_match'),
-        "name_match": source_output.get('name_match'),
-        "user_input_details" : source_output.get('input_details'),
-        "input_pan_number": input_pan_number, 
-        "reference_id" : task.get('task_id')
-    }, 200
+    return response, 200
 
 
 # <------------------------------------------------------------- IDfy Video verify part ------------------------------------------------------------->
@@ -224,7 +233,8 @@ def pass_profile_id(headers, profile_id, email_address = None, user_name = None)
 
 
 # Video kyc get approved on create the auto Agent code
-def agent_code_auto(idfy_received_data, agent_data):
+# raise_errors: transport failures and 5xx raise instead of returning, so the outbox retries them
+def agent_code_auto(idfy_received_data, agent_data, raise_errors=False):
     log_data(message="Recieved agent code auto function", event_type='/callback/video_kyc/automation_agentcode', log_level=logging.INFO, 
              additional_context = {'profile_id': idfy_received_data.get('profile_id')})
     
@@ -258,7 +268,7 @@ def agent_code_auto(idfy_received_data, agent_data):
     }
 
     try:
-        response = requests.post(AGENT_CODE_AUTO_URL, json=json_data, verify=False)
+        response = vendor_request('agent_code', 'POST', AGENT_CODE_AUTO_URL, json=json_data, verify=False)
         log_data(message="Received a response from agent code URL", event_type='/callback/video_kyc/automation_agentcode', log_level=logging.INFO, 
                  additional_context={'json_data': json_data, 'status_code': response.status_code, 'response_text': response.text, 'soap_api_url': AGENT_CODE_AUTO_URL})
         
@@ -279,10 +289,14 @@ def agent_code_auto(idfy_received_data, agent_data):
         else:
             log_data(message=f"Agent code creation failed with status code: {response.status_code}", event_type='/callback/video_kyc/automation_agentcode', log_level=logging.ERROR,
                      additional_context={'profile_id': idfy_received_data.get('profile_id')})
+            if raise_errors and response.status_code >= 500:
+                raise requests.HTTPError(f"Agent code URL answered {response.status_code}", response=response)
             return 'Received Video KYC data Agent code not created'
 
-    except requests.RequestException as e:
+    except (requests.RequestException, CircuitOpenError) as e:
         log_data(message=f"Request to agent code URL failed: {e}", event_type='/callback/video_kyc/automation_agentcode', log_level=logging.ERROR,
                  additional_context={'profile_id': idfy_received_data.get('profile_id')})
+        if raise_errors:
+            raise
         return 'Received Video KYC data Agent code not created'
 
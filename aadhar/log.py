@@ -1,9 +1,10 @@
 import logging
 from logging.handlers import TimedRotatingFileHandler
 import os
-from flask import Flask, request
+from flask import Flask, has_request_context, request
 
-from aadhar.db_logging import database_logging
+from aadhar.log_policy import apply_log_policy
+from aadhar.log_writer import submit_log
 
 app = Flask(__name__)
 
@@ -22,9 +23,14 @@ app.logger.addHandler(file_handler)
 
 
 def log_data(message, event_type, log_level, additional_context=None):
-    browser_info = request.headers.get('User-Agent')
-    ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-    database_logging(message, event_type, additional_context)
+    keep, additional_context = apply_log_policy(event_type, log_level, additional_context)
+    if not keep:
+        return
+
+    # Background threads (async tasks, pollers) log without a request
+    browser_info = request.headers.get('User-Agent') if has_request_context() else None
+    ip_address = request.headers.get('X-Forwarded-For', request.remote_addr) if has_request_context() else None
+    submit_log(message, event_type, additional_context)
 
     try:
         log_message = (f"message: {message}  ---- Event: {event_type} ---- browser_info: {browser_info} ---- "
@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from config import LOG_MAINTENANCE_INTERVAL, LOG_PARTITION_INTERVAL, LOG_PARTITION_PREMAKE, LOG_RETENTION_DAYS
+from aadhar import metrics
+from aadhar.db_logging import ist_timezone, log_connection
+
+logger = logging.getLogger(__name__)
+
+# Any constant works, it only has to be the same in every worker and pod
+MAINTENANCE_LOCK_ID = 72041953
+
+PARTITION_PREFIX = 'idfy_logging_p'
+
+
+# <------------------------------------------------ idfy_logging schema ------------------------------------------------>
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS public.idfy_logging (
+        id bigserial,
+        api_route text,
+        message text,
+        data jsonb,
+        data_received_time timestamptz NOT NULL DEFAULT now()
+    ) PARTITION BY RANGE (data_received_time)
+"""
+
+CREATE_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS idfy_logging_route_time_idx
+        ON public.idfy_logging (api_route, data_received_time)
+"""
+
+# Catches rows outside every range partition so an insert never fails; it should stay empty
+CREATE_DEFAULT_SQL = "CREATE TABLE IF NOT EXISTS public.idfy_logging_default PARTITION OF public.idfy_logging DEFAULT"
+
+
+def _period_start(moment):
+    moment = moment.astimezone(ist_timezone)
+    if LOG_PARTITION_INTERVAL == 'monthly':
+        moment = moment.replace(day=1)
+    return ist_timezone.localize(datetime(moment.year, moment.month, moment.day))
+
+
+def _next_period(start):
+    if LOG_PARTITION_INTERVAL == 'monthly':
+        year, month = (start.year + 1, 1) if start.month == 12 else (start.year, start.month + 1)
+        return ist_timezone.localize(datetime(year, month, 1))
+    return ist_timezone.localize(datetime(start.year, start.month, start.day) + timedelta(days=1))
+
+
+def _partition_name(start):
+    suffix = start.strftime('%Y%m') if LOG_PARTITION_INTERVAL == 'monthly' else start.strftime('%Y%m%d')
+    return f"{PARTITION_PREFIX}{suffix}"
+
+
+def _is_partitioned(cur):
+    cur.execute("""
+        SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = 'idfy_logging'
+    """)
+    row = cur.fetchone()
+    return None if row is None else row[0] == 'p'
+
+
+def ensure_log_schema(cur):
+    partitioned = _is_partitioned(cur)
+    if partitioned is False:
+        raise RuntimeError("public.idfy_logging is a plain table, run `python -m aadhar.log_partitions migrate` first")
+    cur.execute(CREATE_TABLE_SQL)
+    cur.execute(CREATE_INDEX_SQL)
+    cur.execute(CREATE_DEFAULT_SQL)
+
+
+@contextmanager
+def _savepoint(cur, step):
+    # A failed step is rolled back on its own instead of taking the rest of the maintenance run with it
+    cur.execute("SAVEPOINT log_maintenance_step")
+    try:
+        yield
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT log_maintenance_step")
+        metrics.incr('log_partitions.errors')
+        logger.error("idfy_logging maintenance step %s failed: %s", step, e)
+    else:
+        cur.execute("RELEASE SAVEPOINT log_maintenance_step")
+
+
+def _create_partition(cur, name, period, upper):
+    # Rows in the range may already sit in the DEFAULT partition, and PostgreSQL refuses to create
+    # a partition overlapping them; build the table, move those rows in, then attach it
+    cur.execute(f"CREATE TABLE public.{name} (LIKE public.idfy_logging INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM public.idfy_logging_default
+            WHERE data_received_time >= %s AND data_received_time < %s
+            RETURNING *
+        )
+        INSERT INTO public.{name} SELECT * FROM moved
+    """, (period, upper))
+    if cur.rowcount:
+        metrics.incr('log_partitions.rows_moved_from_default', cur.rowcount)
+        logger.warning("Moved %s idfy_logging rows from the DEFAULT partition into %s", cur.rowcount, name)
+    cur.execute(f"ALTER TABLE public.idfy_logging ATTACH PARTITION public.{name} FOR VALUES FROM (%s) TO (%s)", (period, upper))
+
+
+def ensure_partitions(cur, start, end):
+    created = 0
+    period = _period_start(start)
+    while period < end:
+        upper = _next_period(period)
+        name = _partition_name(period)
+        cur.execute("SELECT to_regclass(%s)", (f"public.{name}",))
+        if cur.fetchone()[0] is None:
+            with _savepoint(cur, f"create {name}"):
+                _create_partition(cur, name, period, upper)
+                created += 1
+        period = upper
+    return created
+
+
+def drop_expired_partitions(cur, now):
+    """
+    Detach and drop whole partitions past LOG_RETENTION_DAYS instead of deleting rows.
+    """
+    cutoff = now - timedelta(days=LOG_RETENTION_DAYS)
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'idfy_logging' AND c.relname LIKE %s
+    """, (PARTITION_PREFIX + '%',))
+
+    dropped = []
+    for (name,) in cur.fetchall():
+        suffix = name[len(PARTITION_PREFIX):]
+        try:
+            start = ist_timezone.localize(datetime.strptime(suffix, '%Y%m%d' if len(suffix) == 8 else '%Y%m'))
+        except ValueError:
+            continue
+        if len(suffix) == 8:
+            upper = start + timedelta(days=1)
+        else:
+            upper = ist_timezone.localize(datetime(start.year + start.month // 12, start.month % 12 + 1, 1))
+        if upper <= cutoff:
+            cur.execute(f"ALTER TABLE public.idfy_logging DETACH PARTITION public.{name}")
+            cur.execute(f"DROP TABLE public.{name}")
+            dropped.append(name)
+    return dropped
+
+
+def run_log_maintenance():
+    """
+    Create the table, index and upcoming partitions and drop expired ones.
+    Only one process across all workers and pods does the work at a time.
+    """
+    now = datetime.now(ist_timezone)
+    started = time.monotonic()
+
+    with log_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (MAINTENANCE_LOCK_ID,))
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return None
+
+                ensure_log_schema(cur)
+                ahead = now
+                for _ in range(LOG_PARTITION_PREMAKE + 1):
+                    ahead = _next_period(_period_start(ahead))
+                ensure_partitions(cur, now, ahead)
+                dropped = []
+                with _savepoint(cur, 'retention'):
+                    dropped = drop_expired_partitions(cur, now)
+            conn.commit()
+
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+    metrics.observe('log_partitions.maintenance', time.monotonic() - started)
+    metrics.incr('log_partitions.dropped', len(dropped))
+    if dropped:
+        logger.info("Dropped expired idfy_logging partitions: %s", ', '.join(dropped))
+    return dropped
+
+
+def _maintenance_loop():
+    while True:
+        try:
+            run_log_maintenance()
+        except Exception as e:
+            metrics.incr('log_partitions.errors')
+            logger.error("idfy_logging partition maintenance failed: %s", e)
+        time.sleep(LOG_MAINTENANCE_INTERVAL)
+
+
+_maintenance_state = {'pid': None}
+
+
+def start_log_maintenance():
+    if _maintenance_state['pid'] == os.getpid():
+        return
+    _maintenance_state['pid'] = os.getpid()
+    threading.Thread(target=_maintenance_loop, name='pg-log-maintenance', daemon=True).start()
+
+
+# <------------------------------------------------ One-off migration ------------------------------------------------>
+
+def migrate_legacy_table():
+    """
+    Swap the old unpartitioned idfy_logging (text data_received_time) for the partitioned
+    table and copy rows still inside the retention window. The old table is kept as
+    idfy_logging_legacy for the operator to drop.
+    """
+    now = datetime.now(ist_timezone)
+    cutoff = now - timedelta(days=LOG_RETENTION_DAYS)
+
+    with log_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                if _is_partitioned(cur) is not False:
+                    print("public.idfy_logging is already partitioned or missing, nothing to migrate")
+                    conn.rollback()
+                    return
+
+                cur.execute("ALTER TABLE public.idfy_logging RENAME TO idfy_logging_legacy")
+                ensure_log_schema(cur)
+                ensure_partitions(cur, cutoff, _next_period(_period_start(now)))
+                cur.execute("""
+                    INSERT INTO public.idfy_logging (api_route, message, data, data_received_time)
+                    SELECT api_route, message, data::text::jsonb, data_received_time::timestamptz
+                    FROM public.idfy_logging_legacy
+                    WHERE data_received_time::timestamptz >= %s
+                """, (cutoff,))
+                print(f"Copied {cur.rowcount} rows into the partitioned idfy_logging")
+            conn.commit()
+
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'maintain'
+    if command == 'migrate':
+        migrate_legacy_table()
+    elif command == 'maintain':
+        print(f"Dropped partitions: {run_log_maintenance()}")
+    else:
+        sys.exit("usage: python -m aadhar.log_partitions [maintain|migrate]")
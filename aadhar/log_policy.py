@@ -0,0 +1,113 @@
+import json
+import random
+import logging
+
+from config import (LOG_ELIDE_KEYS, LOG_EVENT_POLICIES, LOG_INFO_SAMPLE_RATE, LOG_MAX_LIST_ITEMS, LOG_MAX_STRING_LENGTH,
+                    LOG_PAYLOAD_MAX_BYTES)
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ log_data payload policy ------------------------------------------------>
+
+DEFAULT_POLICY = {
+    'max_bytes': LOG_PAYLOAD_MAX_BYTES,
+    'max_string_length': LOG_MAX_STRING_LENGTH,
+    'max_list_items': LOG_MAX_LIST_ITEMS,
+    'elide_keys': LOG_ELIDE_KEYS,
+    'info_sample_rate': LOG_INFO_SAMPLE_RATE,
+}
+
+
+def _load_event_policies():
+    try:
+        overrides = json.loads(LOG_EVENT_POLICIES)
+    except ValueError:
+        logger.error("LOG_EVENT_POLICIES is not valid JSON, using the default log policy for every event")
+        overrides = {}
+
+    policies = {}
+    for event_type, override in overrides.items():
+        policy = dict(DEFAULT_POLICY, **override)
+        policy['elide_keys'] = frozenset(policy['elide_keys'])
+        policies[event_type] = policy
+    return policies
+
+
+EVENT_POLICIES = _load_event_policies()
+_default_policy = dict(DEFAULT_POLICY, elide_keys=frozenset(LOG_ELIDE_KEYS))
+
+
+def get_policy(event_type):
+    return EVENT_POLICIES.get(event_type, _default_policy)
+
+
+def _serialized_size(value):
+    return len(json.dumps(value, default=str))
+
+
+def _shrink(value, policy):
+    if isinstance(value, dict):
+        shrunk = {}
+        for key, item in value.items():
+            if key in policy['elide_keys'] and item:
+                shrunk[key] = {'_elided': True, 'bytes': _serialized_size(item)}
+            else:
+                shrunk[key] = _shrink(item, policy)
+        return shrunk
+
+    if isinstance(value, (list, tuple)):
+        items = [_shrink(item, policy) for item in value[:policy['max_list_items']]]
+        if len(value) > policy['max_list_items']:
+            items.append({'_truncated_items': len(value) - policy['max_list_items']})
+        return items
+
+    if isinstance(value, str) and len(value) > policy['max_string_length']:
+        return f"{value[:policy['max_string_length']]}...<truncated {len(value) - policy['max_string_length']} chars>"
+
+    return value
+
+
+def apply_log_policy(event_type, log_level, additional_context):
+    """
+    Returns (keep, context): keep is False for INFO events sampled out, context is the
+    additional_context with large keys elided and strings/lists truncated to fit max_bytes.
+    """
+    policy = get_policy(event_type)
+
+    if log_level <= logging.INFO and policy['info_sample_rate'] < 1 and random.random() >= policy['info_sample_rate']:
+        metrics.incr('log_policy.sampled_out')
+        return False, None
+
+    if not additional_context:
+        return True, additional_context
+
+    try:
+        original_size = _serialized_size(additional_context)
+        if original_size <= policy['max_bytes'] and not _has_elided_key(additional_context, policy['elide_keys']):
+            return True, additional_context
+
+        context = _shrink(additional_context, policy)
+        size = _serialized_size(context)
+        if size > policy['max_bytes']:
+            # Still too big after field-level trimming, keep only the shape
+            context = {'_truncated': True, 'bytes': original_size,
+                       'keys': list(additional_context) if isinstance(additional_context, dict) else None}
+            size = _serialized_size(context)
+
+    except Exception as e:
+        logger.error("Failed to apply log policy for %s: %s", event_type, e)
+        return True, additional_context
+
+    metrics.incr('log_policy.truncated')
+    metrics.incr('log_policy.bytes_saved', max(original_size - size, 0))
+    return True, context
+
+
+def _has_elided_key(value, elide_keys):
+    if isinstance(value, dict):
+        return any((key in elide_keys and item) or _has_elided_key(item, elide_keys) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return any(_has_elided_key(item, elide_keys) for item in value)
+    return False
@@ -0,0 +1,240 @@
+import os
+import glob
+import json
+import time
+import logging
+import threading
+
+import psycopg2
+
+from config import LOG_BATCH_SIZE, LOG_SPOOL_CLAIM_TIMEOUT, LOG_SPOOL_DIR, LOG_SPOOL_FSYNC, LOG_SPOOL_REPLAY_INTERVAL, LOG_SPOOL_SEGMENT_BYTES
+from aadhar import metrics
+from aadhar.db_logging import LOG_DB_UNAVAILABLE_ERRORS, copy_log_rows, ping_log_db
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ Local spool for idfy_logging rows ------------------------------------------------>
+
+# Segment life cycle, one writer per file:
+#   segment-<pid>-<ns>.open            appended to by worker <pid>
+#   segment-<pid>-<ns>.ready           sealed, waiting for replay
+#   segment-<pid>-<ns>.replaying-<pid> claimed by the worker replaying it (rename is atomic, so only one worker wins);
+#                                      its mtime is bumped on claim and after every chunk, an old mtime means a stuck claim
+#   dead/segment-<pid>-<ns>.rows       rows PostgreSQL rejected for good (bad data, schema mismatch), kept for inspection
+
+_lock = threading.Lock()
+_state = {'pid': None, 'file': None, 'path': None, 'size': 0, 'db_available': True, 'replayer_pid': None}
+
+
+def db_available():
+    return _state['db_available']
+
+
+def mark_db_unavailable():
+    if _state['db_available']:
+        logger.error("PostgreSQL log database unavailable, spooling log rows to %s", LOG_SPOOL_DIR)
+    _state['db_available'] = False
+
+
+def _segment_path(suffix):
+    return os.path.join(LOG_SPOOL_DIR, f"segment-{os.getpid()}-{time.time_ns()}.{suffix}")
+
+
+def _segment_pid(path):
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _fsync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def _seal_locked():
+    if _state['file'] is None:
+        return
+    _fsync(_state['file'])
+    _state['file'].close()
+    os.rename(_state['path'], _state['path'][:-len('.open')] + '.ready')
+    _state.update(file=None, path=None, size=0)
+
+
+def spool_rows(rows):
+    """
+    Append log rows to this worker's open segment. Never raises, rows that can't be
+    written to disk either are counted as lost.
+    """
+    try:
+        with _lock:
+            if _state['pid'] != os.getpid():
+                # The parent's open segment belongs to the parent, flushed data means nothing to write twice
+                _state.update(pid=os.getpid(), file=None, path=None, size=0)
+
+            if _state['file'] is None:
+                os.makedirs(LOG_SPOOL_DIR, exist_ok=True)
+                _state['path'] = _segment_path('open')
+                _state['file'] = open(_state['path'], 'a', encoding='utf-8')
+
+            for row in rows:
+                line = json.dumps(row) + '\n'
+                _state['file'].write(line)
+                _state['size'] += len(line)
+                if LOG_SPOOL_FSYNC == 'always':
+                    _fsync(_state['file'])
+
+            if LOG_SPOOL_FSYNC == 'batch':
+                _fsync(_state['file'])
+            else:
+                _state['file'].flush()
+
+            if _state['size'] >= LOG_SPOOL_SEGMENT_BYTES:
+                _seal_locked()
+
+        metrics.incr('log_spool.rows_spooled', len(rows))
+        return True
+
+    except Exception as e:
+        metrics.incr('log_spool.rows_lost', len(rows))
+        logger.error("Failed to spool %s log rows: %s", len(rows), e)
+        return False
+
+
+def _read_segment(path):
+    rows = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                rows.append(tuple(json.loads(line)))
+            except ValueError:
+                # A torn last line from a worker killed mid-write
+                metrics.incr('log_spool.corrupt_lines')
+    return rows
+
+
+def _write_ready_segment(rows):
+    path = _segment_path('open')
+    with open(path, 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(json.dumps(row) + '\n')
+        _fsync(file)
+    os.rename(path, path[:-len('.open')] + '.ready')
+
+
+def _dead_letter_rows(rows, error):
+    dead_dir = os.path.join(LOG_SPOOL_DIR, 'dead')
+    os.makedirs(dead_dir, exist_ok=True)
+    path = os.path.join(dead_dir, f"segment-{os.getpid()}-{time.time_ns()}.rows")
+    with open(path, 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(json.dumps(row) + '\n')
+        _fsync(file)
+    metrics.incr('log_spool.rows_dead_lettered', len(rows))
+    logger.error("PostgreSQL rejected %s spooled log rows, moved to %s: %s", len(rows), path, error)
+
+
+def _recover_orphans():
+    # Segments left behind by dead workers, or claims that never finished. Another worker may
+    # recover the same file first, that is fine.
+    try:
+        for path in glob.glob(os.path.join(LOG_SPOOL_DIR, 'segment-*.open')):
+            if not _pid_alive(_segment_pid(path)):
+                os.rename(path, path[:-len('.open')] + '.ready')
+
+        for path in glob.glob(os.path.join(LOG_SPOOL_DIR, 'segment-*.replaying-*')):
+            claimer = int(path.rsplit('-', 1)[1])
+            stale = time.time() - os.path.getmtime(path) > LOG_SPOOL_CLAIM_TIMEOUT
+            if stale or not _pid_alive(claimer):
+                os.rename(path, path.rsplit('.replaying-', 1)[0] + '.ready')
+    except FileNotFoundError:
+        pass
+
+
+def _replay_segment(path):
+    rows = _read_segment(path)
+    for start in range(0, len(rows), LOG_BATCH_SIZE):
+        chunk = rows[start:start + LOG_BATCH_SIZE]
+        try:
+            written = copy_log_rows(chunk)
+        except LOG_DB_UNAVAILABLE_ERRORS:
+            # Keep whatever has not been committed yet for the next round
+            _write_ready_segment(rows[start:])
+            os.remove(path)
+            return False
+        except psycopg2.Error as e:
+            # Retrying won't help these rows; set them aside and carry on with the rest
+            _dead_letter_rows(chunk, e)
+        else:
+            metrics.incr('log_spool.rows_replayed', written)
+        # Still working on this claim, keep _recover_orphans in other workers off it
+        os.utime(path)
+
+    os.remove(path)
+    return True
+
+
+def replay_spool():
+    """
+    Bulk load sealed segments back into idfy_logging. Runs on the replayer thread only.
+    """
+    try:
+        ping_log_db()
+    except LOG_DB_UNAVAILABLE_ERRORS:
+        mark_db_unavailable()
+        return
+
+    if os.path.isdir(LOG_SPOOL_DIR):
+        with _lock:
+            if _state['pid'] == os.getpid():
+                _seal_locked()
+
+        _recover_orphans()
+
+        for path in sorted(glob.glob(os.path.join(LOG_SPOOL_DIR, 'segment-*.ready'))):
+            claimed = path[:-len('.ready')] + f'.replaying-{os.getpid()}'
+            try:
+                os.rename(path, claimed)
+                # rename keeps the sealed segment's mtime, which would already look like a stale claim
+                os.utime(claimed)
+            except FileNotFoundError:
+                continue
+
+            started = time.monotonic()
+            if not _replay_segment(claimed):
+                mark_db_unavailable()
+                return
+            metrics.observe('log_spool.replay_segment', time.monotonic() - started)
+
+    if not _state['db_available']:
+        logger.info("PostgreSQL log database reachable again, spool replayed")
+    _state['db_available'] = True
+
+
+def _replay_loop():
+    while True:
+        time.sleep(LOG_SPOOL_REPLAY_INTERVAL)
+        try:
+            replay_spool()
+        except Exception as e:
+            logger.error("Log spool replay failed: %s", e)
+
+
+def start_replayer():
+    if _state['replayer_pid'] == os.getpid():
+        return
+    _state['replayer_pid'] = os.getpid()
+    threading.Thread(target=_replay_loop, name='pg-log-spool-replayer', daemon=True).start()
@@ -0,0 +1,142 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from config import LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_FULL_POLICY, LOG_QUEUE_MAX_SIZE, LOG_QUEUE_PUT_TIMEOUT, LOG_SHUTDOWN_TIMEOUT
+from aadhar import log_spool, metrics
+from aadhar.log_partitions import start_log_maintenance
+from aadhar.db_logging import LOG_DB_UNAVAILABLE_ERRORS, build_log_row, copy_log_rows
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+# <------------------------------------------------ Background PostgreSQL log writer ------------------------------------------------>
+
+class LogWriter:
+    """
+    Queues idfy_logging rows in memory and writes them from a single background thread,
+    LOG_BATCH_SIZE rows or LOG_FLUSH_INTERVAL seconds at a time, whichever comes first.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_MAX_SIZE)
+        self.thread = threading.Thread(target=self._run, name='pg-log-writer', daemon=True)
+        self.stopped = False
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, row):
+        if self.stopped:
+            metrics.incr('log_writer.dropped')
+            return False
+        try:
+            if LOG_QUEUE_FULL_POLICY == 'block':
+                self.queue.put(row, timeout=LOG_QUEUE_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait(row)
+        except queue.Full:
+            metrics.incr('log_writer.dropped')
+            return False
+
+        metrics.set_gauge('log_writer.queue_depth', self.queue.qsize())
+        return True
+
+    def stop(self, timeout=LOG_SHUTDOWN_TIMEOUT):
+        if self.stopped:
+            return
+        self.stopped = True
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.error("Log writer queue full at shutdown, %s rows not drained", self.queue.qsize())
+            return
+        self.thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        flush_at = time.monotonic() + LOG_FLUSH_INTERVAL
+
+        while True:
+            try:
+                row = self.queue.get(timeout=max(flush_at - time.monotonic(), 0))
+            except queue.Empty:
+                row = None
+
+            if row is _STOP:
+                self._flush(batch)
+                return
+
+            if row is not None:
+                batch.append(row)
+
+            if len(batch) >= LOG_BATCH_SIZE or time.monotonic() >= flush_at:
+                self._flush(batch)
+                batch = []
+                flush_at = time.monotonic() + LOG_FLUSH_INTERVAL
+
+    def _flush(self, batch):
+        metrics.set_gauge('log_writer.queue_depth', self.queue.qsize())
+        if not batch:
+            return
+
+        # While the database is down rows go straight to disk, the spool replayer decides when it is back
+        if not log_spool.db_available():
+            log_spool.spool_rows(batch)
+            return
+
+        started = time.monotonic()
+        try:
+            written = copy_log_rows(batch)
+            metrics.incr('log_writer.rows_written', written)
+        except LOG_DB_UNAVAILABLE_ERRORS:
+            metrics.incr('log_writer.flush_errors')
+            log_spool.mark_db_unavailable()
+            log_spool.spool_rows(batch)
+        except Exception as e:
+            metrics.incr('log_writer.flush_errors')
+            metrics.incr('log_writer.rows_lost', len(batch))
+            logger.error("Failed to write %s log rows to PostgreSQL: %s", len(batch), e)
+        finally:
+            metrics.observe('log_writer.flush', time.monotonic() - started)
+
+
+_writer_lock = threading.Lock()
+_writer_state = {'pid': None, 'writer': None}
+
+
+def get_log_writer():
+    # Threads do not survive fork, every gunicorn worker starts its own writer on first use
+    pid = os.getpid()
+    if _writer_state['pid'] != pid:
+        with _writer_lock:
+            if _writer_state['pid'] != pid:
+                _writer_state['writer'] = LogWriter().start()
+                log_spool.start_replayer()
+                start_log_maintenance()
+                _writer_state['pid'] = pid
+    return _writer_state['writer']
+
+
+def submit_log(message=None, event_type=None, additional_context=None):
+    try:
+        row = build_log_row(message, event_type, additional_context)
+    except Exception as e:
+        metrics.incr('log_writer.dropped')
+        logger.error("Failed to build log row: %s", e)
+        return False
+    return get_log_writer().submit(row)
+
+
+def shutdown_log_writer(timeout=LOG_SHUTDOWN_TIMEOUT):
+    if _writer_state['pid'] == os.getpid():
+        _writer_state['writer'].stop(timeout)
+
+
+atexit.register(shutdown_log_writer)
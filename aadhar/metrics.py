@@ -0,0 +1,39 @@
+import threading
+
+
+# <------------------------------------------------ Per-process counters and timings ------------------------------------------------>
+
+# Every gunicorn worker keeps its own numbers; /admin/metrics reports the worker that served the call.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+        timing['count'] += 1
+        timing['total_seconds'] += seconds
+        timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+
+def snapshot():
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            avg = timing['total_seconds'] / timing['count'] if timing['count'] else 0.0
+            timings[name] = dict(timing, avg_seconds=round(avg, 6))
+        return {'counters': dict(_counters), 'gauges': dict(_gauges), 'timings': timings}
@@ -0,0 +1,203 @@
+import os
+import sys
+import logging
+import threading
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import CALLBACK_LEDGER_TTL_DAYS, DB_CLIENT, IDFY_TASK_EVENT_TTL_SECONDS, MONGO_URI
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ Index registry ------------------------------------------------>
+
+# Every index the service relies on. Unique indexes sit on the fields the code upserts by; the
+# partial filter leaves older documents without the field out of the uniqueness check.
+INDEXES = [
+    {'collection': 'Finvesta_Aadhar', 'keys': [('request_ref_id', ASCENDING)], 'unique': True,
+     'partialFilterExpression': {'request_ref_id': {'$type': 'string'}}},
+    {'collection': 'Finvesta_Aadhar', 'keys': [('reference_id', ASCENDING)]},
+    {'collection': 'Finvesta_video_kyc', 'keys': [('generate_profile_id', ASCENDING)], 'unique': True,
+     'partialFilterExpression': {'generate_profile_id': {'$type': 'string'}}},
+    {'collection': 'Finvesta_video_kyc', 'keys': [('raw_payload_id', ASCENDING)]},
+    {'collection': 'Finvesta_video_kyc_raw', 'keys': [('generate_profile_id', ASCENDING), ('source', ASCENDING)], 'unique': True},
+    {'collection': 'Finvesta_PanCard', 'keys': [('task_id', ASCENDING)]},
+    {'collection': 'Finvesta_PanCard', 'keys': [('verification_key', ASCENDING), ('verified_at', DESCENDING)]},
+    {'collection': 'finvesta_users', 'keys': [('video_kyc.profile_id', ASCENDING)]},
+    {'collection': 'distributor_users', 'keys': [('video_kyc.profile_id', ASCENDING)]},
+    {'collection': 'bharat_api_records', 'keys': [('request_id', ASCENDING), ('result_id', ASCENDING)]},
+    {'collection': 'bharat_api_records', 'keys': [('type', ASCENDING), ('status', ASCENDING), ('bank_account', ASCENDING), ('ifsc', ASCENDING)]},
+    {'collection': 'idfy_async_tasks', 'keys': [('request_id', ASCENDING)], 'unique': True},
+    {'collection': 'idfy_task_events', 'keys': [('created_at', ASCENDING)], 'expireAfterSeconds': IDFY_TASK_EVENT_TTL_SECONDS},
+    {'collection': 'callback_jobs', 'keys': [('status', ASCENDING), ('available_at', ASCENDING)]},
+    {'collection': 'callback_jobs', 'keys': [('status', ASCENDING), ('lease_until', ASCENDING)]},
+    {'collection': 'callback_ledger', 'keys': [('kind', ASCENDING), ('subject_id', ASCENDING), ('status', ASCENDING),
+                                               ('reviewer_action', ASCENDING), ('payload_hash', ASCENDING)],
+     'unique': True, 'name': 'callback_ledger_dedup'},
+    {'collection': 'callback_ledger', 'keys': [('created_at', ASCENDING)], 'expireAfterSeconds': CALLBACK_LEDGER_TTL_DAYS * 86400},
+    {'collection': 'idempotency_keys', 'keys': [('expires_at', ASCENDING)], 'expireAfterSeconds': 0},
+    {'collection': 'inflight_requests', 'keys': [('expires_at', ASCENDING)], 'expireAfterSeconds': 0},
+    {'collection': 'callback_outbox', 'keys': [('key', ASCENDING)], 'unique': True},
+    {'collection': 'callback_outbox', 'keys': [('status', ASCENDING), ('available_at', ASCENDING)]},
+    {'collection': 'callback_outbox', 'keys': [('status', ASCENDING), ('lease_until', ASCENDING)]},
+    {'collection': 'callback_outbox', 'keys': [('status', ASCENDING), ('created_at', DESCENDING)]},
+]
+
+# Shapes of the hot queries, checked with explain() for collection scans
+QUERIES = [
+    ('Finvesta_Aadhar', {'reference_id': 'x'}),
+    ('Finvesta_Aadhar', {'request_ref_id': 'x'}),
+    ('Finvesta_video_kyc', {'generate_profile_id': 'x'}),
+    ('Finvesta_PanCard', {'task_id': 'x'}),
+    ('Finvesta_PanCard', {'verification_key': 'x', 'verified_at': {'$gte': datetime.now(timezone.utc)}}),
+    ('finvesta_users', {'video_kyc.profile_id': 'x'}),
+    ('distributor_users', {'video_kyc.profile_id': 'x'}),
+    ('bharat_api_records', {'request_id': 'x', 'result_id': 'x'}),
+    ('bharat_api_records', {'type': 'bank_account', 'status': 'completed', 'bank_account': 'x', 'ifsc': 'x'}),
+    ('idfy_async_tasks', {'request_id': 'x'}),
+    ('callback_jobs', {'status': 'pending', 'available_at': {'$lte': datetime.now(timezone.utc)}}),
+    ('callback_jobs', {'status': 'running', 'lease_until': {'$lt': datetime.now(timezone.utc)}}),
+    ('callback_outbox', {'key': 'x'}),
+    ('callback_outbox', {'status': 'failed'}),
+]
+
+INDEX_OPTIONS = ('unique', 'expireAfterSeconds', 'partialFilterExpression')
+
+
+def index_name(spec):
+    return spec.get('name') or '_'.join(f"{field}_{direction}" for field, direction in spec['keys'])
+
+
+def _mismatch(spec, existing):
+    # Differences between the declared index and the one on the server, empty when they agree
+    problems = []
+    if [tuple(key) for key in existing['key']] != list(spec['keys']):
+        problems.append(f"keys {existing['key']}")
+    for option in INDEX_OPTIONS:
+        declared, actual = spec.get(option) or None, existing.get(option) or None
+        if declared != actual:
+            problems.append(f"{option}={actual!r}, declared {declared!r}")
+    return problems
+
+
+def ensure_indexes(db):
+    """
+    Create every registered index that is missing. Existing indexes that differ from the
+    registry are reported, not rebuilt. Returns a list of (collection, index, outcome).
+    """
+    report = []
+    for spec in INDEXES:
+        collection = db[spec['collection']]
+        name = index_name(spec)
+        try:
+            existing = collection.index_information().get(name)
+            if existing is not None:
+                problems = _mismatch(spec, existing)
+                report.append((spec['collection'], name, 'differs: ' + '; '.join(problems) if problems else 'ok'))
+                continue
+
+            options = {option: spec[option] for option in INDEX_OPTIONS if spec.get(option) is not None}
+            collection.create_index(spec['keys'], name=name, **options)
+            metrics.incr('mongo_indexes.created')
+            report.append((spec['collection'], name, 'created'))
+
+        except OperationFailure as e:
+            # Typically duplicates under a unique index; they have to be cleaned up by hand
+            metrics.incr('mongo_indexes.failed')
+            report.append((spec['collection'], name, f"failed: {e}"))
+    return report
+
+
+_required = {'pid': None, 'collections': set()}
+_required_lock = threading.Lock()
+
+
+def require_unique_indexes(collection):
+    """
+    Create the registered unique indexes of `collection` before code that relies on
+    DuplicateKeyError writes to it; once per worker, a no-op when they already exist. Doesn't
+    wait for the background bootstrap, whose first run may still be going or may be turned off.
+    """
+    if _required['pid'] == os.getpid() and collection.name in _required['collections']:
+        return
+    with _required_lock:
+        if _required['pid'] != os.getpid():
+            _required.update(pid=os.getpid(), collections=set())
+        if collection.name in _required['collections']:
+            return
+        for spec in INDEXES:
+            if spec['collection'] == collection.name and spec.get('unique'):
+                options = {option: spec[option] for option in INDEX_OPTIONS if spec.get(option) is not None}
+                collection.create_index(spec['keys'], name=index_name(spec), **options)
+        _required['collections'].add(collection.name)
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def check_queries(db):
+    """
+    explain() every registered query shape; returns a list of (collection, filter, stages, collscan).
+    """
+    report = []
+    for collection_name, query in QUERIES:
+        explained = db[collection_name].find(query).explain()
+        stages = list(_stages(explained.get('queryPlanner', {}).get('winningPlan', {})))
+        report.append((collection_name, query, stages, 'COLLSCAN' in stages))
+    return report
+
+
+def _bootstrap():
+    from aadhar.aadhar import mongodb
+
+    try:
+        for collection_name, name, outcome in ensure_indexes(mongodb):
+            if outcome == 'created':
+                logger.info("Mongo index %s.%s created", collection_name, name)
+            elif outcome != 'ok':
+                logger.warning("Mongo index %s.%s: %s", collection_name, name, outcome)
+    except PyMongoError as e:
+        logger.error("Mongo index bootstrap failed: %s", e)
+
+
+_bootstrap_state = {'pid': None}
+_bootstrap_lock = threading.Lock()
+
+
+def start_index_bootstrap():
+    # Off the import path so a long first build doesn't hold up worker boot
+    if _bootstrap_state['pid'] == os.getpid():
+        return
+    with _bootstrap_lock:
+        if _bootstrap_state['pid'] != os.getpid():
+            _bootstrap_state['pid'] = os.getpid()
+            threading.Thread(target=_bootstrap, name='mongo-index-bootstrap', daemon=True).start()
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'ensure'
+    db = MongoClient(MONGO_URI)[DB_CLIENT]
+    if command == 'ensure':
+        report = ensure_indexes(db)
+        for collection_name, name, outcome in report:
+            print(f"{collection_name}.{name}: {outcome}")
+        sys.exit(1 if any(outcome.startswith(('failed', 'differs')) for _, _, outcome in report) else 0)
+    elif command == 'check':
+        report = check_queries(db)
+        for collection_name, query, stages, collscan in report:
+            print(f"{'COLLSCAN' if collscan else 'ok'}  {collection_name} {query}  {' <- '.join(stages)}")
+        sys.exit(1 if any(collscan for *_, collscan in report) else 0)
+    else:
+        sys.exit("usage: python -m aadhar.mongo_indexes [ensure|check]")
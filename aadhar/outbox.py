@@ -0,0 +1,124 @@
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from config import OUTBOX_EFFECT_CONCURRENCY
+from aadhar.mongo_indexes import require_unique_indexes
+from aadhar.utils import ds_flow_server_auto_approved
+from aadhar.idfy_utils import agent_code_auto
+from aadhar.video_profile import video_kyc_reject_resend_link
+
+
+# <------------------------------------------------ Callback side-effect outbox ------------------------------------------------>
+
+def _supports_transactions(client):
+    return client.topology_description.topology_type_name in ('ReplicaSetWithPrimary', 'Sharded')
+
+
+@contextmanager
+def outbox_transaction(client):
+    """
+    Session for writing the KYC update and its outbox entries in one transaction. Yields None
+    on a standalone mongod: the writes then go one by one, and a crash between them is covered
+    by the callback job being retried (outbox entries are upserted by key).
+    """
+    if not _supports_transactions(client):
+        yield None
+        return
+    with client.start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+def record_effect(effect, delivery, payload, session=None):
+    """
+    Queue a side effect of the callback delivery; the callback job worker dispatches it.
+    Recording the same (delivery, effect) again is a no-op.
+    """
+    from aadhar.aadhar import CALLBACK_OUTBOX
+
+    # Without the unique index on key, two concurrent upserts can both insert
+    require_unique_indexes(CALLBACK_OUTBOX)
+    now = datetime.now(timezone.utc)
+    CALLBACK_OUTBOX.update_one({'key': f"{delivery}:{effect}"}, {'$setOnInsert': {
+        'kind': effect,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'available_at': now,
+        'created_at': now,
+    }}, upsert=True, session=session)
+
+
+# <------------------------------------------------ Effect handlers ------------------------------------------------>
+
+_effect_slots = {effect: threading.BoundedSemaphore(limit) for effect, limit in json.loads(OUTBOX_EFFECT_CONCURRENCY).items()}
+
+
+@contextmanager
+def _slot(effect):
+    slots = _effect_slots.get(effect)
+    if slots is None:
+        yield
+        return
+    with slots:
+        yield
+
+
+def _agent_code(payload, timer, job):
+    with _slot('agent_code'), timer.stage('agent_code'):
+        agent_code_auto(payload['idfy_received_data'], payload['agent_data'], raise_errors=True)
+
+
+def _ds_auto_approve(payload, timer, job):
+    with _slot('ds_auto_approve'), timer.stage('ds_auto_approve'):
+        ds_flow_server_auto_approved(payload['idfy_received_data'], payload['agent_data'])
+
+
+def _resend_link(payload, timer, job):
+    # The new link and the sent email are recorded on the entry as they happen; a retry picks up after
+    # the last finished step. Only a crash between sending the email and recording it sends it twice.
+    from aadhar.aadhar import CALLBACK_OUTBOX
+
+    def save_progress(step):
+        CALLBACK_OUTBOX.update_one({'_id': job['_id']}, {'$set': {f'progress.{name}': value for name, value in step.items()}})
+
+    with _slot('resend_link'), timer.stage('resend_link'):
+        video_kyc_reject_resend_link(payload['idfy_received_data'], payload['profile_id'], raise_errors=True,
+                                     progress=job.get('progress'), save_progress=save_progress)
+
+
+OUTBOX_HANDLERS = {
+    'agent_code': _agent_code,
+    'ds_auto_approve': _ds_auto_approve,
+    'resend_link': _resend_link,
+}
+
+
+def dead_letters(limit=100):
+    from aadhar.aadhar import CALLBACK_OUTBOX
+
+    return list(CALLBACK_OUTBOX.find({'status': 'failed'},
+                                     {'key': 1, 'kind': 1, 'attempts': 1, 'last_error': 1, 'created_at': 1, 'available_at': 1})
+                .sort('created_at', -1).limit(limit))
+
+
+def requeue_dead_letter(entry_id):
+    # Fresh attempt budget; False when entry_id is not a failed entry
+    from aadhar.aadhar import CALLBACK_OUTBOX
+    from aadhar.callback_jobs import wake_up_workers
+
+    try:
+        object_id = ObjectId(entry_id)
+    except InvalidId:
+        return False
+
+    result = CALLBACK_OUTBOX.update_one({'_id': object_id, 'status': 'failed'},
+                                        {'$set': {'status': 'pending', 'attempts': 0, 'available_at': datetime.now(timezone.utc)}})
+    if result.matched_count:
+        wake_up_workers()
+    return bool(result.matched_count)
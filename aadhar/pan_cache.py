@@ -0,0 +1,118 @@
+import hmac
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from pymongo import DESCENDING
+
+from config import PAN_CACHE_HMAC_KEY, PAN_CACHE_LRU_SIZE, PAN_CACHE_TTL_SECONDS
+from aadhar import metrics
+from aadhar.projections import fields
+from aadhar.utils import aes_decrypt, derive_hmac_key
+
+
+# <------------------------------------------------ PAN verification cache ------------------------------------------------>
+
+_hmac_key = PAN_CACHE_HMAC_KEY.encode() if PAN_CACHE_HMAC_KEY else derive_hmac_key('pan-cache-verification-key')
+
+# Only definitive positive outcomes are replayed; anything else is verified afresh
+CACHEABLE_PAN_STATUS = 'Existing and Valid'
+
+
+def verification_key(request_data):
+    """
+    Keyed hash of the normalized pan/dob/name; the PAN itself never appears in the key.
+    """
+    normalized = '|'.join([
+        str(request_data['pan_number']).strip().upper(),
+        str(request_data['dob']).strip(),
+        ' '.join(str(request_data['full_name']).split()).casefold(),
+    ])
+    return hmac.new(_hmac_key, normalized.encode(), hashlib.sha256).hexdigest()
+
+
+def pan_response(task, input_pan_number):
+    # /pancard body for a completed IDfy task (input_details carry the encrypted PAN)
+    source_output = task.get('result', {}).get('source_output', {})
+    return {
+        "status" : task.get('status'),
+        "pan_status": source_output.get('pan_status'),
+        "dob_match": source_output.get('dob_match'),
+        "name_match": source_output.get('name_match'),
+        "user_input_details" : source_output.get('input_details'),
+        "input_pan_number": input_pan_number,
+        "reference_id" : task.get('task_id')
+    }
+
+
+_lru_lock = threading.Lock()
+_lru = OrderedDict()   # key -> (expires_at monotonic, response)
+
+
+def _lru_get(key):
+    with _lru_lock:
+        entry = _lru.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _lru[key]
+            return None
+        _lru.move_to_end(key)
+        return entry[1]
+
+
+def _lru_put(key, response, ttl):
+    if PAN_CACHE_LRU_SIZE <= 0 or ttl <= 0:
+        return
+    with _lru_lock:
+        _lru[key] = (time.monotonic() + ttl, response)
+        _lru.move_to_end(key)
+        while len(_lru) > PAN_CACHE_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def cached_pan_verification(request_data):
+    """
+    Response of a completed verification of the same inputs within PAN_CACHE_TTL_SECONDS,
+    or None.
+    """
+    from aadhar.aadhar import PANCARD_DATA
+
+    if PAN_CACHE_TTL_SECONDS <= 0:
+        return None
+
+    key = verification_key(request_data)
+    response = _lru_get(key)
+    if response is not None:
+        metrics.incr('pan_cache.hit.lru')
+        return response
+
+    task = PANCARD_DATA.find_one(
+        {'verification_key': key, 'verified_at': {'$gte': datetime.now(timezone.utc) - timedelta(seconds=PAN_CACHE_TTL_SECONDS)}},
+        fields('pan_cache'), sort=[('verified_at', DESCENDING)])
+    if not task:
+        metrics.incr('pan_cache.miss')
+        return None
+
+    input_details = task.get('result', {}).get('source_output', {}).get('input_details', {})
+    response = pan_response(task, aes_decrypt(input_details.get('input_pan_number')))
+    remaining = PAN_CACHE_TTL_SECONDS - (datetime.now(timezone.utc) - task['verified_at'].replace(tzinfo=timezone.utc)).total_seconds()
+    _lru_put(key, response, remaining)
+    metrics.incr('pan_cache.hit.mongo')
+    return response
+
+
+def remember_pan_verification(task, request_data, response):
+    # Tag the task about to be stored in PANCARD_DATA so later lookups find it. Only call with a task
+    # fetched from the authenticated IDfy status API; failed or mismatching results are not tagged.
+    if not (response.get('status') == 'completed' and str(response.get('pan_status') or '').startswith(CACHEABLE_PAN_STATUS)
+            and response.get('name_match') is True and response.get('dob_match') is True):
+        metrics.incr('pan_cache.not_cacheable')
+        return
+
+    key = verification_key(request_data)
+    task['verification_key'] = key
+    task['verified_at'] = datetime.now(timezone.utc)
+    _lru_put(key, response, PAN_CACHE_TTL_SECONDS)
@@ -4,13 +4,20 @@ from flask import Blueprint, jsonify, request
 from config import FIN_ACCOUNT_ID, FIN_API_KEY
 from aadhar.log import log_data
 from aadhar.utils import aes_decrypt
-from aadhar.idfy_utils import fetch_pan_card_data
+from aadhar.projections import fields
+from aadhar.pan_cache import cached_pan_verification, verification_key
+from aadhar.single_flight import flight_key, single_flight
+from aadhar.idempotency import idempotent
+from aadhar.circuit_breaker import CircuitOpenError
+from aadhar.idfy_utils import fetch_pan_card_data, start_pan_task
+from aadhar.idfy_tasks import accept_task, wants_async
 
 
 # Create a Blueprint instance
 pan_bp = Blueprint('pancard', __name__)
 
 @pan_bp.route('/pancard', methods=['POST'])
+@idempotent
 def pancard_document():
     try:
         request_data = request.json
@@ -25,8 +32,26 @@ def pancard_document():
                 'api-key': FIN_API_KEY,
                 'Content-Type': 'application/json',
             } 
-        return fetch_pan_card_data(request_data, headers)
 
+        # Same PAN, DOB and name verified recently (typically the onboarding form resubmitted)
+        cached = cached_pan_verification(request_data)
+        if cached:
+            log_data(message="PAN verification served from cache", event_type='/pancard', log_level=logging.INFO,
+                     additional_context = {'reference_id': cached.get('reference_id')})
+            return cached, 200
+
+        if wants_async():
+            request_id, error_response = start_pan_task(request_data, headers)
+            if not request_id:
+                return error_response
+            return accept_task('pan', request_id, request_data=request_data)
+
+        # A double submit shares the first call's IDfy task and result
+        return single_flight(flight_key('pan', verification_key(request_data)), lambda: fetch_pan_card_data(request_data, headers))
+
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message=str(e), event_type='/pancard', log_level=logging.ERROR, additional_context = {'request_data': request_data, 'return_data': str(e)})
         return jsonify({"error": str(e)}), 500
@@ -43,7 +68,7 @@ def get_pan_number():
         if not reference_id:
             return jsonify({"error": f"Missing mandatory fields: Reference id"}), 400
 
-        pancard_data = PANCARD_DATA.find_one({'task_id': reference_id})
+        pancard_data = PANCARD_DATA.find_one({'task_id': reference_id}, fields('pan_number'))
         if pancard_data:
 
             result = pancard_data.get('result', {})
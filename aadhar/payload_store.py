@@ -0,0 +1,150 @@
+import sys
+import json
+import time
+import zlib
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+from bson import Binary
+from pymongo import MongoClient, ReturnDocument
+
+from config import DB_CLIENT, MONGO_URI, VIDEO_KYC_MIGRATION_BATCH, VIDEO_KYC_MIGRATION_PAUSE
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bulky parts of the IDfy profile; only resources.text is read from the video KYC document
+COLD_FIELDS = ('resources', 'tasks')
+ENCODING = 'zlib+json'
+
+
+# <------------------------------------------------ Hot/cold split of IDfy video KYC payloads ------------------------------------------------>
+
+def split_payload(payload):
+    """
+    (hot, cold) halves of an IDfy profile payload. The hot half keeps resources.text, which
+    the status endpoints and agent code match against; payload itself is not modified.
+    """
+    hot = {key: value for key, value in payload.items() if key not in COLD_FIELDS}
+    cold = {key: payload[key] for key in COLD_FIELDS if key in payload}
+    if 'resources' in cold:
+        hot['resources'] = {'text': (cold['resources'] or {}).get('text', [])}
+    return hot, cold
+
+
+def encode_payload(cold):
+    return Binary(zlib.compress(json.dumps(cold, default=str, separators=(',', ':')).encode()))
+
+
+def decode_payload(document):
+    return json.loads(zlib.decompress(document['data']))
+
+
+def _store_cold(raw_collection, profile_id, source, cold, session=None):
+    # One cold document per (profile, source), rewritten only when the payload changed; status polls
+    # mostly see the same payload again
+    digest = hashlib.sha256(json.dumps(cold, default=str, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+    existing = raw_collection.find_one({'generate_profile_id': profile_id, 'source': source}, {'payload_hash': 1}, session=session)
+    if existing and existing.get('payload_hash') == digest:
+        metrics.incr('payload_store.unchanged')
+        return existing['_id']
+
+    data = encode_payload(cold)
+    metrics.incr('payload_store.cold_bytes', len(data))
+    now = datetime.now(timezone.utc)
+    stored = raw_collection.find_one_and_update(
+        {'generate_profile_id': profile_id, 'source': source},
+        {'$set': {'encoding': ENCODING, 'data': data, 'payload_hash': digest, 'updated_at': now}, '$setOnInsert': {'created_at': now}},
+        projection={'_id': 1}, upsert=True, return_document=ReturnDocument.AFTER, session=session)
+    return stored['_id']
+
+
+def kyc_update(profile_id, source, payload, session=None):
+    """
+    Store the cold half of payload compressed in Finvesta_video_kyc_raw (one document per
+    profile and source, replaced as the payload changes) and return the update for the hot
+    document, which $sets the hot half and a raw_payload_id reference.
+    """
+    from aadhar.aadhar import FIN_VIDEO_KYC_RAW
+
+    hot, cold = split_payload(payload)
+    if not cold:
+        return {'$set': hot}
+
+    hot['raw_payload_id'] = _store_cold(FIN_VIDEO_KYC_RAW, profile_id, source, cold, session)
+    # tasks left over from before the split go along with the rest of the cold half
+    return {'$set': hot, '$unset': {'tasks': ''}}
+
+
+def load_raw_payload(raw_payload_id):
+    # Full vendor payload behind a video KYC document, None when it was never split
+    from aadhar.aadhar import FIN_VIDEO_KYC_RAW
+
+    document = FIN_VIDEO_KYC_RAW.find_one({'_id': raw_payload_id})
+    return decode_payload(document) if document else None
+
+
+# <------------------------------------------------ Migration of existing documents ------------------------------------------------>
+
+def migrate_video_kyc_documents(db, batch_size=VIDEO_KYC_MIGRATION_BATCH, pause=VIDEO_KYC_MIGRATION_PAUSE):
+    """
+    Move resources/tasks of video KYC documents written before the split into the cold
+    collection. Runs in batches with a pause in between so it can go alongside live traffic;
+    a document rewritten by a request meanwhile is left to that request. Safe to rerun.
+    """
+    video_kyc, raw_collection = db['Finvesta_video_kyc'], db['Finvesta_video_kyc_raw']
+
+    pending = {'raw_payload_id': {'$exists': False}, '$or': [{'tasks': {'$exists': True}}, {'resources': {'$exists': True}}]}
+    migrated = 0
+    while True:
+        documents = list(video_kyc.find(pending, {'generate_profile_id': 1, 'resources': 1, 'tasks': 1}).limit(batch_size))
+        if not documents:
+            return migrated
+
+        for document in documents:
+            hot, cold = split_payload({key: document[key] for key in COLD_FIELDS if key in document})
+            profile_id = document.get('generate_profile_id')
+            # Documents without a profile id would all share one (None, 'migration') cold document
+            source = 'migration' if profile_id else f"migration:{document['_id']}"
+            hot['raw_payload_id'] = _store_cold(raw_collection, profile_id, source, cold)
+            result = video_kyc.update_one({'_id': document['_id'], 'raw_payload_id': {'$exists': False}}, {'$set': hot, '$unset': {'tasks': ''}})
+            migrated += result.modified_count
+
+        logger.info("Video KYC documents migrated so far: %s", migrated)
+        time.sleep(pause)
+
+
+def prune_superseded_payloads(db, batch_size=VIDEO_KYC_MIGRATION_BATCH, pause=VIDEO_KYC_MIGRATION_PAUSE):
+    """
+    Delete cold documents written before one document per (profile, source) was kept: for each
+    pair only the newest survives, which the unique index on the pair needs. Safe to rerun.
+    """
+    raw_collection = db['Finvesta_video_kyc_raw']
+    duplicated = raw_collection.aggregate([
+        {'$sort': {'created_at': -1}},
+        {'$group': {'_id': {'generate_profile_id': '$generate_profile_id', 'source': '$source'}, 'ids': {'$push': '$_id'}}},
+        {'$match': {'ids.1': {'$exists': True}}},
+    ], allowDiskUse=True)
+
+    pruned = 0
+    for group in duplicated:
+        superseded = group['ids'][1:]
+        for start in range(0, len(superseded), batch_size):
+            pruned += raw_collection.delete_many({'_id': {'$in': superseded[start:start + batch_size]}}).deleted_count
+            time.sleep(pause)
+    # A hot document points at the latest write for its profile, which is the newest of its pair and is kept
+    return pruned
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    if command == 'migrate':
+        logging.basicConfig(level=logging.INFO)
+        db = MongoClient(MONGO_URI)[DB_CLIENT]
+        print(f"Migrated video KYC documents: {migrate_video_kyc_documents(db)}")
+    elif command == 'prune':
+        db = MongoClient(MONGO_URI)[DB_CLIENT]
+        print(f"Deleted superseded raw payloads: {prune_superseded_payloads(db)}")
+    else:
+        sys.exit("usage: python -m aadhar.payload_store [migrate|prune]")
@@ -0,0 +1,65 @@
+import random
+import threading
+from collections import deque
+
+from config import (IDFY_CALLBACK_GRACE, IDFY_POLL_BACKOFF, IDFY_POLL_FIRST_PROBE, IDFY_POLL_HISTORY, IDFY_POLL_JITTER, IDFY_POLL_MAX_DELAY,
+                    IDFY_POLL_MIN_DELAY)
+from aadhar import metrics
+
+
+# <------------------------------------------------ Adaptive IDfy polling schedule ------------------------------------------------>
+
+_lock = threading.Lock()
+_completion_times = {}   # task_type -> deque of seconds from submission to completion
+
+
+def record_completion(task_type, seconds):
+    with _lock:
+        history = _completion_times.setdefault(task_type, deque(maxlen=IDFY_POLL_HISTORY))
+        history.append(seconds)
+        samples = sorted(history)
+
+    for name, value in percentiles(samples).items():
+        metrics.set_gauge(f'idfy_poll.{task_type}.completion_{name}', round(value, 3))
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    last = len(samples) - 1
+    return {f'p{p}': samples[min(last, int(round(last * p / 100)))] for p in (50, 90, 99)}
+
+
+def learned_percentiles(task_type):
+    with _lock:
+        return percentiles(sorted(_completion_times.get(task_type, ())))
+
+
+def _jitter(delay):
+    return delay * random.uniform(1 - IDFY_POLL_JITTER, 1 + IDFY_POLL_JITTER)
+
+
+def first_delay(task_type):
+    """
+    Probe slightly before the typical completion time so the median task is caught on the
+    first or second check rather than a fixed 5 seconds in.
+    """
+    p50 = learned_percentiles(task_type).get('p50')
+    delay = IDFY_POLL_FIRST_PROBE if p50 is None else p50 * 0.8
+    delay = min(max(_jitter(delay), IDFY_POLL_MIN_DELAY), IDFY_POLL_MAX_DELAY)
+    # When IDfy posts completions to /callback, polling is only the fallback
+    return max(delay, IDFY_CALLBACK_GRACE)
+
+
+def next_delay(previous_delay):
+    return min(max(_jitter(previous_delay * IDFY_POLL_BACKOFF), IDFY_POLL_MIN_DELAY), IDFY_POLL_MAX_DELAY)
+
+
+def clip_to_deadline(now, delay, deadline):
+    # Spend the last probe just before the caller gives up instead of after
+    remaining = deadline - now
+    if remaining <= 0:
+        return 0
+    if delay >= remaining:
+        return max(remaining - IDFY_POLL_MIN_DELAY / 2, IDFY_POLL_MIN_DELAY / 2)
+    return delay
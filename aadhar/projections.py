@@ -0,0 +1,101 @@
+import sys
+import time
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+
+from config import DB_CLIENT, MONGO_URI
+
+
+# <------------------------------------------------ Per-endpoint read projections ------------------------------------------------>
+
+# Fields each request-path read actually uses; the raw vendor responses next to them stay on the server.
+# 'key' is the field the endpoint looks documents up by (used by the benchmark below).
+PROJECTIONS = {
+    'aadhar_data': {
+        'collection': 'Finvesta_Aadhar', 'key': 'reference_id',
+        'fields': {'_id': 0, 'status': 1, 'parsed_details': 1, 'aadhar_number': 1},
+    },
+    'pan_number': {
+        'collection': 'Finvesta_PanCard', 'key': 'task_id',
+        'fields': {'_id': 0, 'task_id': 1, 'result.source_output.input_details': 1},
+    },
+    'pan_cache': {
+        'collection': 'Finvesta_PanCard', 'key': 'verification_key',
+        'fields': {'_id': 0, 'task_id': 1, 'status': 1, 'verified_at': 1, 'result.source_output': 1},
+    },
+    'bank_account_cache': {
+        'collection': 'bharat_api_records', 'key': 'bank_account',
+        'fields': {'verify_response.data': 1},
+    },
+    'bank_account_status': {
+        'collection': 'bharat_api_records', 'key': 'result_id',
+        'fields': {'_id': 1},
+    },
+    'video_kyc_status': {
+        'collection': 'Finvesta_video_kyc', 'key': 'generate_profile_id',
+        'fields': {'_id': 0, 'resources.text': 1, 'aadhar_name': 1, 'aadhar_dob': 1, 'request_time': 1},
+    },
+    'video_kyc_agent': {
+        'collection': 'Finvesta_video_kyc', 'key': 'generate_profile_id',
+        'fields': {'_id': 0, 'generate_profile_id': 1, 'user_type': 1, 'aadhar_name': 1, 'aadhar_dob': 1},
+    },
+    'video_kyc_archive': {
+        'collection': 'Finvesta_video_kyc', 'key': 'generate_profile_id',
+        'fields': {'file_archive': 1},
+    },
+}
+
+
+def fields(name):
+    return PROJECTIONS[name]['fields']
+
+
+# <------------------------------------------------ Benchmark ------------------------------------------------>
+
+def _measure(collection, keys, key_field, projection):
+    raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    total_bytes, fetch_seconds, decode_seconds = 0, 0.0, 0.0
+    for key in keys:
+        started = time.perf_counter()
+        document = raw_collection.find_one({key_field: key}, projection)
+        fetch_seconds += time.perf_counter() - started
+        if document is None:
+            continue
+        total_bytes += len(document.raw)
+        started = time.perf_counter()
+        bson.decode(document.raw)
+        decode_seconds += time.perf_counter() - started
+    return total_bytes, fetch_seconds, decode_seconds
+
+
+def benchmark(db, samples=200):
+    """
+    For every declared read, fetch `samples` real documents with and without the projection
+    and report bytes on the wire, round-trip and BSON decode time.
+    """
+    report = []
+    for name, spec in PROJECTIONS.items():
+        collection = db[spec['collection']]
+        keys = [document[spec['key']] for document in
+                collection.find({spec['key']: {'$exists': True}}, {spec['key']: 1}).limit(samples)]
+        if not keys:
+            continue
+        full = _measure(collection, keys, spec['key'], None)
+        projected = _measure(collection, keys, spec['key'], spec['fields'])
+        report.append((name, len(keys), full, projected))
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] != 'bench':
+        sys.exit("usage: python -m aadhar.projections bench [samples]")
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    db = MongoClient(MONGO_URI)[DB_CLIENT]
+
+    print(f"{'read':<22}{'docs':>6}{'bytes full':>14}{'bytes proj':>14}{'fetch ms':>18}{'decode ms':>18}")
+    for name, count, full, projected in benchmark(db, samples):
+        print(f"{name:<22}{count:>6}{full[0]:>14}{projected[0]:>14}"
+              f"{full[1] * 1000:>9.1f}/{projected[1] * 1000:<8.1f}{full[2] * 1000:>9.2f}/{projected[2] * 1000:<8.2f}")
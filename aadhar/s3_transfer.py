@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+
+from config import AWS_S3_BUCKET_NAME, S3_ARCHIVE_PER_HOST, S3_ARCHIVE_WORKERS, S3_PART_SIZE, S3_TRANSFER_CONCURRENCY
+from aadhar import metrics
+from aadhar.clients import get_s3_client
+from aadhar.http_client import vendor_request
+
+# Memory per transfer is bounded by roughly part size * (concurrency + 1)
+transfer_config = TransferConfig(
+    multipart_threshold=S3_PART_SIZE,
+    multipart_chunksize=S3_PART_SIZE,
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+
+
+class TransferIncomplete(Exception):
+    pass
+
+
+# <------------------------------------------------ Streaming URL -> S3 ------------------------------------------------>
+
+class HashingReader:
+    """
+    File-like wrapper over the HTTP body that hashes and counts what S3 reads. read(n) fills
+    the whole n bytes unless the body ends, s3transfer turns every read into a part and S3
+    rejects short parts.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.raw.read()
+        else:
+            chunks = []
+            remaining = size
+            while remaining > 0:
+                chunk = self.raw.read(remaining)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            data = b''.join(chunks)
+
+        self.sha256.update(data)
+        self.bytes_read += len(data)
+        return data
+
+
+def stream_url_to_s3(url, s3_object_name, content_type=None):
+    """
+    Pipe the body at url into s3_object_name without buffering the whole file: large bodies
+    go up as a multipart upload, each part checksummed (SHA-256) by S3. The stored size is
+    checked against what was read and against Content-Length.
+    """
+    started = time.monotonic()
+    with vendor_request('idfy_files', 'GET', url, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        expected_length = response.headers.get('Content-Length') if not response.headers.get('Content-Encoding') else None
+        source_etag = response.headers.get('ETag', '').strip('"') or None
+
+        reader = HashingReader(response.raw)
+        extra_args = {'ChecksumAlgorithm': 'SHA256'}
+        if content_type:
+            extra_args['ContentType'] = content_type
+        get_s3_client().upload_fileobj(reader, AWS_S3_BUCKET_NAME, s3_object_name, ExtraArgs=extra_args, Config=transfer_config)
+
+    if expected_length is not None and int(expected_length) != reader.bytes_read:
+        raise TransferIncomplete(f"Read {reader.bytes_read} of {expected_length} bytes from {url}")
+
+    stored = get_s3_client().head_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_object_name)
+    if stored['ContentLength'] != reader.bytes_read:
+        raise TransferIncomplete(f"S3 stored {stored['ContentLength']} of {reader.bytes_read} bytes for {s3_object_name}")
+
+    seconds = time.monotonic() - started
+    metrics.incr('s3_transfer.bytes', reader.bytes_read)
+    metrics.observe('s3_transfer', seconds)
+    if seconds > 0:
+        metrics.set_gauge('s3_transfer.last_mb_per_second', round(reader.bytes_read / seconds / 1024 / 1024, 2))
+
+    return {
+        'bytes': reader.bytes_read,
+        'sha256': reader.sha256.hexdigest(),
+        'etag': stored.get('ETag', '').strip('"'),
+        'source_etag': source_etag,
+        'seconds': round(seconds, 3),
+    }
+
+
+def source_fingerprint(url):
+    """
+    ETag and length the source reports for url without downloading it, or None when the
+    server doesn't answer HEAD (some signed URLs are GET-only).
+    """
+    try:
+        response = vendor_request('idfy_files', 'HEAD', url, allow_redirects=True)
+    except Exception:
+        return None
+    if response.status_code != 200 or not response.headers.get('ETag'):
+        return None
+    return {'etag': response.headers['ETag'].strip('"'), 'length': response.headers.get('Content-Length')}
+
+
+def stored_object_matches(s3_object_name, record):
+    try:
+        stored = get_s3_client().head_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_object_name)
+    except Exception:
+        return False
+    return stored['ContentLength'] == record.get('bytes') and stored.get('ETag', '').strip('"') == record.get('etag')
+
+
+# <------------------------------------------------ Bounded parallel archival ------------------------------------------------>
+
+_archive_lock = threading.Lock()
+_archive_state = {'pid': None, 'executor': None, 'host_slots': {}}
+
+
+def _archive_executor():
+    pid = os.getpid()
+    if _archive_state['pid'] != pid:
+        with _archive_lock:
+            if _archive_state['pid'] != pid:
+                _archive_state['executor'] = ThreadPoolExecutor(max_workers=S3_ARCHIVE_WORKERS, thread_name_prefix='s3-archive')
+                _archive_state['host_slots'] = {}
+                _archive_state['pid'] = pid
+    return _archive_state['executor']
+
+
+def _host_slots(url):
+    host = urlparse(url).netloc
+    with _archive_lock:
+        slots = _archive_state['host_slots'].get(host)
+        if slots is None:
+            slots = _archive_state['host_slots'][host] = threading.BoundedSemaphore(S3_ARCHIVE_PER_HOST)
+    return slots
+
+
+def submit_archive(task, url, *args):
+    """
+    Run task(url, *args) on the process-wide archive pool, holding one of the source
+    host's slots while it runs. Returns a Future.
+    """
+    def _run():
+        with _host_slots(url):
+            return task(url, *args)
+
+    return _archive_executor().submit(_run)
@@ -0,0 +1,146 @@
+import os
+import hmac
+import json
+import time
+import socket
+import hashlib
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from config import SINGLE_FLIGHT_LEASE_SECONDS, SINGLE_FLIGHT_POLL_INTERVAL, SINGLE_FLIGHT_RESULT_SECONDS
+from aadhar import metrics
+from aadhar.utils import aes_decrypt, aes_encrypt, derive_hmac_key
+
+
+# <------------------------------------------------ Single-flight coalescing ------------------------------------------------>
+
+_hmac_key = derive_hmac_key('single-flight-key')
+
+
+def flight_key(kind, *parts):
+    # Keyed hash so account numbers, PANs etc. don't show up in the inflight_requests collection
+    digest = hmac.new(_hmac_key, '|'.join(str(part) for part in parts).encode(), hashlib.sha256).hexdigest()
+    return f"{kind}:{digest}"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _encode(result):
+    # Results can carry decrypted PANs; they sit in Mongo encrypted
+    return aes_encrypt(json.dumps(result, default=str))
+
+
+def _decode(stored):
+    result = json.loads(aes_decrypt(stored))
+    return tuple(result) if isinstance(result, list) else result
+
+
+def _acquire(collection, key, owner):
+    now = _now()
+    lease_until = now + timedelta(seconds=SINGLE_FLIGHT_LEASE_SECONDS)
+    lease = {'status': 'running', 'owner': owner, 'lease_until': lease_until,
+             'expires_at': lease_until + timedelta(seconds=SINGLE_FLIGHT_RESULT_SECONDS)}
+    try:
+        collection.insert_one(dict(lease, _id=key))
+        return True
+    except DuplicateKeyError:
+        pass
+
+    # The previous flight finished a while ago, or its owner died holding the lease
+    taken = collection.find_one_and_update(
+        {'_id': key, '$or': [
+            {'status': 'done', 'done_at': {'$lt': now - timedelta(seconds=SINGLE_FLIGHT_RESULT_SECONDS)}},
+            {'status': 'running', 'lease_until': {'$lt': now}},
+        ]},
+        {'$set': lease, '$unset': {'result': '', 'done_at': ''}},
+    )
+    return taken is not None
+
+
+def _shareable(result):
+    # (body, status_code) results with a 5xx status are not handed to other callers
+    if isinstance(result, (tuple, list)) and len(result) == 2 and isinstance(result[1], int):
+        return result[1] < 500
+    return True
+
+
+def _lead(collection, key, owner, call):
+    try:
+        result = call()
+    except Exception:
+        # Let a waiting worker take over instead of sitting out the lease
+        collection.delete_one({'_id': key, 'owner': owner})
+        raise
+
+    if not _shareable(result):
+        # A failed upstream call is the leader's alone; identical callers after it try for themselves
+        collection.delete_one({'_id': key, 'owner': owner})
+        metrics.incr('single_flight.not_shared')
+        return result
+
+    now = _now()
+    collection.update_one({'_id': key, 'owner': owner}, {'$set': {
+        'status': 'done',
+        'result': _encode(result),
+        'done_at': now,
+        'expires_at': now + timedelta(seconds=SINGLE_FLIGHT_RESULT_SECONDS),
+    }, '$unset': {'lease_until': ''}})
+    return result
+
+
+def _across_workers(key, call):
+    from aadhar.aadhar import INFLIGHT_REQUESTS
+
+    owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    deadline = time.monotonic() + SINGLE_FLIGHT_LEASE_SECONDS
+    while time.monotonic() < deadline:
+        if _acquire(INFLIGHT_REQUESTS, key, owner):
+            metrics.incr('single_flight.led')
+            return _lead(INFLIGHT_REQUESTS, key, owner, call)
+
+        flight = INFLIGHT_REQUESTS.find_one({'_id': key}, {'status': 1, 'result': 1})
+        if flight and flight['status'] == 'done':
+            metrics.incr('single_flight.joined_remote')
+            return _decode(flight['result'])
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+    # The flight outlived its lease without anyone finishing it; don't keep the caller waiting
+    metrics.incr('single_flight.wait_timeouts')
+    return call()
+
+
+_local_lock = threading.Lock()
+_local_flights = {}   # key -> Future
+
+
+def single_flight(key, call):
+    """
+    Run call() once for all concurrent callers with the same key, in this worker and in
+    other workers and pods, and hand every caller its return value. call() has to return
+    something JSON-serializable, e.g. a (body, status_code) tuple.
+    """
+    with _local_lock:
+        future = _local_flights.get(key)
+        leader = future is None
+        if leader:
+            future = _local_flights[key] = Future()
+
+    if not leader:
+        metrics.incr('single_flight.joined_local')
+        return future.result()
+
+    try:
+        result = _across_workers(key, call)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _local_lock:
+            _local_flights.pop(key, None)
@@ -0,0 +1,91 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from config import IDFY_TASK_EVENT_POLL_INTERVAL
+from aadhar import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# <------------------------------------------------ IDfy task completion events ------------------------------------------------>
+
+def is_task_callback(payload):
+    # Task-shaped IDfy callbacks look like one entry of the status API response
+    return bool(payload.get('request_id')) and bool(payload.get('status')) and payload.get('status') != 'in_progress'
+
+
+def publish_task_completion(request_id):
+    """
+    Have whoever waits on request_id check its status right away: directly when it is this
+    worker, through the idfy_task_events collection for the other workers and pods. Only the
+    request_id is passed on; the callback body is never taken as the task result.
+    """
+    from aadhar.aadhar import IDFY_TASK_EVENTS
+    from aadhar.idfy_poller import get_poller
+
+    get_poller().wake(request_id)
+    IDFY_TASK_EVENTS.insert_one({
+        'request_id': request_id,
+        'created_at': datetime.now(timezone.utc),
+    })
+    metrics.incr('task_events.published')
+
+
+def _deliver(event):
+    from aadhar.idfy_poller import get_poller
+
+    get_poller().wake(event['request_id'])
+
+
+def _listen_change_stream(collection):
+    with collection.watch([{'$match': {'operationType': 'insert'}}]) as stream:
+        for change in stream:
+            _deliver(change['fullDocument'])
+
+
+def _listen_polling(collection, since):
+    # Stand-in for change streams on a standalone mongod: tail the collection by _id
+    last_id = ObjectId.from_datetime(since)
+    while True:
+        for event in collection.find({'_id': {'$gt': last_id}}, {'request_id': 1}).sort('_id', 1):
+            last_id = event['_id']
+            _deliver(event)
+        time.sleep(IDFY_TASK_EVENT_POLL_INTERVAL)
+
+
+def _listen():
+    from aadhar.aadhar import IDFY_TASK_EVENTS
+
+    since = datetime.now(timezone.utc)
+    while True:
+        try:
+            _listen_change_stream(IDFY_TASK_EVENTS)
+        except OperationFailure as e:
+            logger.info("Change streams unavailable (%s), polling idfy_task_events instead", e)
+            try:
+                _listen_polling(IDFY_TASK_EVENTS, since)
+            except PyMongoError as e:
+                logger.error("idfy_task_events polling failed: %s", e)
+        except PyMongoError as e:
+            logger.error("idfy_task_events change stream failed: %s", e)
+        metrics.incr('task_events.listener_restarts')
+        time.sleep(1)
+
+
+_listener_state = {'pid': None}
+_listener_lock = threading.Lock()
+
+
+def start_task_event_listener():
+    if _listener_state['pid'] == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_state['pid'] != os.getpid():
+            _listener_state['pid'] = os.getpid()
+            threading.Thread(target=_listen, name='idfy-task-events', daemon=True).start()
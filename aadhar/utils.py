@@ -2,22 +2,24 @@ import base64
 import io
 import logging
 
+import time
 import uuid
-import boto3
 
 from PIL import Image 
 from datetime import datetime
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives import hashes, padding
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
 from botocore.exceptions import NoCredentialsError
 import requests
 import pytz
 
-from config import AES_ENCRYPT_SECRET_KEY, AWS_ACCESS_KEY_ID, AWS_S3_BUCKET_NAME, AWS_SECRET_ACCESS_KEY
+from config import AES_ENCRYPT_SECRET_KEY, AWS_S3_BUCKET_NAME
 from aadhar.log import log_data
-
-s3_client  = boto3.client('s3', aws_access_key_id = AWS_ACCESS_KEY_ID, aws_secret_access_key = AWS_SECRET_ACCESS_KEY)
+from aadhar import metrics
+from aadhar.clients import get_s3_client
+from aadhar.s3_transfer import source_fingerprint, stored_object_matches, stream_url_to_s3, submit_archive
 
 # Format the current timestamp to include date, time, and AM/PM
 def added_time():
@@ -57,40 +59,95 @@ def found_file_link_idfy(idfy_received_data):
     return file_data
 
 
-def upload_files_to_s3(file_data, profile_id):
+def _unchanged_archive(url, s3_object_name, previous):
+    # Same artifact already in S3 from an earlier callback: same source (URL or ETag) and the stored object is intact
+    if not previous or previous.get('s3_key') != s3_object_name:
+        return False
+    if previous.get('source_url') != url:
+        fingerprint = source_fingerprint(url)
+        if not fingerprint or not previous.get('source_etag') or fingerprint['etag'] != previous['source_etag']:
+            return False
+    return stored_object_matches(s3_object_name, previous)
+
+
+def _archive_file(url, key, profile_id, previous=None, raise_errors=False):
+    started = time.monotonic()
+    try:
+        if 'document' in key:
+            s3_object_name, content_type = f"{profile_id}_{key}.pdf", 'application/pdf'
+        elif 'image' in key:
+            s3_object_name, content_type = f"{profile_id}_{key}.jpg", 'image/jpeg'
+        elif 'video' in key:
+            s3_object_name, content_type = f"{profile_id}_{key}.mp4", 'video/mp4'
+        else:
+            s3_object_name, content_type = f"{profile_id}_{key}", None
+        s3_file_url = f"https://{AWS_S3_BUCKET_NAME}.s3.amazonaws.com/{s3_object_name}"
+
+        if _unchanged_archive(url, s3_object_name, previous):
+            metrics.incr('s3_archive.skipped')
+            metrics.incr('s3_archive.bytes_avoided', previous.get('bytes') or 0)
+            return s3_file_url, dict(previous, source_url=url), previous.get('bytes') or 0
+
+        # Streamed straight from IDfy into S3, videos are never held in memory whole
+        transfer = stream_url_to_s3(url, s3_object_name, content_type)
+        log_data(message="File archived to S3", event_type='video_kyc/s3/file', log_level=logging.INFO,
+                 additional_context={'profile_id': profile_id, 'key': key, 'bytes': transfer['bytes'], 'seconds': transfer['seconds']})
+
+        record = {
+            'source_url': url,
+            'source_etag': transfer['source_etag'],
+            's3_key': s3_object_name,
+            'sha256': transfer['sha256'],
+            'etag': transfer['etag'],
+            'bytes': transfer['bytes'],
+        }
+        return s3_file_url, record, 0
+    
+    except requests.RequestException as e:
+        log_data(message = f"Failed to download file from {url}: {e}", event_type='video_kyc/s3/file', log_level=logging.ERROR)
+        if raise_errors:
+            raise
+        return f"Error: Failed to download file from {url}", None, 0
+
+    except NoCredentialsError:
+        log_data(message = "Credentials not available", event_type='video_kyc/s3/file', log_level=logging.ERROR)
+        if raise_errors:
+            raise
+        return "Error: AWS credentials not available", None, 0
+    
+    except Exception as e:        
+        log_data(message=f"Error uploading file to S3: {e}", event_type='video_kyc/s3/file', log_level=logging.ERROR)
+        if raise_errors:
+            raise
+        return f"Error uploading file to S3: {e}", None, 0
+
+    finally:
+        metrics.observe('s3_archive.file', time.monotonic() - started)
+
+
+# All files of a profile are archived in parallel on the shared archive pool. previous_archive is the
+# file_archive recorded by an earlier callback; unchanged artifacts are not transferred again.
+# Returns (s3_file_urls, file_archive); with raise_errors a failed file raises instead of leaving an error string
+# in its URL, so the callback job retries the archive
+def upload_files_to_s3(file_data, profile_id, previous_archive=None, raise_errors=False):
+    started = time.monotonic()
+    previous_archive = previous_archive or {}
+    futures = {key: submit_archive(_archive_file, url, key, profile_id, previous_archive.get(key), raise_errors) for key, url in file_data.items()}
+
     s3_file_urls = {}
-    for key, url in file_data.items():
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-
-            if 'document' in key:
-                s3_object_name = f"{profile_id}_{key}.pdf"
-            elif 'image' in key:
-                s3_object_name = f"{profile_id}_{key}.jpg"
-            elif 'video' in key:
-                s3_object_name = f"{profile_id}_{key}.mp4"
-            else:
-                s3_object_name = f"{profile_id}_{key}"
-
-            s3_client.put_object(Bucket=AWS_S3_BUCKET_NAME, Key=s3_object_name, Body=response.content)
-            
-            s3_file_url = f"https://{AWS_S3_BUCKET_NAME}.s3.amazonaws.com/{s3_object_name}"
-            s3_file_urls[key] = s3_file_url
-        
-        except requests.RequestException as e:
-            log_data(message = f"Failed to download file from {url}: {e}", event_type='video_kyc/s3/file', log_level=logging.ERROR)
-            s3_file_urls[key] = f"Error: Failed to download file from {url}"
-
-        except NoCredentialsError:
-            log_data(message = "Credentials not available", event_type='video_kyc/s3/file', log_level=logging.ERROR)
-            s3_file_urls[key] = "Error: AWS credentials not available"
-        
-        except Exception as e:        
-            log_data(message=f"Error uploading file to S3: {e}", event_type='video_kyc/s3/file', log_level=logging.ERROR)
-            s3_file_urls[key] = f"Error uploading file to S3: {e}"
-
-    return s3_file_urls
+    file_archive = {}
+    bytes_avoided = 0
+    for key, future in futures.items():
+        s3_file_urls[key], record, avoided = future.result()
+        bytes_avoided += avoided
+        if record:
+            file_archive[key] = record
+
+    seconds = time.monotonic() - started
+    metrics.observe('s3_archive.profile', seconds)
+    log_data(message="Profile files archived to S3", event_type='video_kyc/s3/file', log_level=logging.INFO,
+             additional_context={'profile_id': profile_id, 'files': len(file_data), 'seconds': round(seconds, 3), 'bytes_avoided': bytes_avoided})
+    return s3_file_urls, file_archive
 
 
 # <--------------------------------------------------  AES Encrypt ----------------------------------------------------->
@@ -115,6 +172,10 @@ def aes_encrypt(data):
     encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
     return base64.urlsafe_b64encode(encrypted_data).decode()
 
+def derive_hmac_key(purpose):
+    # Own key per HMAC use, derived from the AES secret; the AES key is never used as an HMAC key directly
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=purpose.encode(), backend=default_backend()).derive(aes_key)
+
 def aes_decrypt(encrypted_data):
     cipher = Cipher(algorithms.AES(aes_key), modes.CBC(fixed_iv), backend=default_backend())
     decryptor = cipher.decryptor()
@@ -130,12 +191,6 @@ def aes_decrypt(encrypted_data):
 def upload_files_to_s3_bharat(file_object, profile_id):
     try:
 
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-
         s3_object_name = f"bharat_aadhaar_image_{profile_id}.jpg"
         image_data = base64.b64decode(file_object)
         image_file = io.BytesIO(image_data)
@@ -145,7 +200,7 @@ def upload_files_to_s3_bharat(file_object, profile_id):
         img.save(image_byte_array, format='JPEG')
         image_byte_array.seek(0)
 
-        s3_client.upload_fileobj(
+        get_s3_client().upload_fileobj(
             Fileobj=image_byte_array,
             Bucket=AWS_S3_BUCKET_NAME,
             Key=s3_object_name,
@@ -1,6 +1,7 @@
 import os
 import logging
 from flask import Blueprint, jsonify, request
+from pymongo import ReturnDocument
 
 from aadhar.email_html import video_kyc_resend_html_agent
 from aadhar.video_status_email import send_email
@@ -8,6 +9,10 @@ from config import PRO_ACCOUNT_ID, PRO_API_KEY, VIDEO_KYC_RESEND_SUB_AGENT
 from aadhar.log import log_data
 from aadhar.utils import added_time, generate_id
 from aadhar.idfy_utils import get_video_verify, pass_profile_id
+from aadhar.payload_store import kyc_update
+from aadhar.projections import fields
+from aadhar.idempotency import idempotent
+from aadhar.circuit_breaker import CircuitOpenError
 
 
 # Create a Blueprint instance
@@ -15,6 +20,7 @@ profile_bp = Blueprint('profile', __name__)
 
 
 @profile_bp.route('/generate/link', methods=['POST'])
+@idempotent
 def generate_video_link():
     """
     Generate IDFY Video KYC Link
@@ -135,6 +141,9 @@ def generate_video_link():
         
         return get_video_verify(headers, json_data, reference_id, request_data)
 
+    except CircuitOpenError:
+        # Answered with 503 + Retry-After by the app's error handler
+        raise
     except Exception as e:
         log_data(message={"error": str(e)}, event_type = '/generate/link',log_level=logging.ERROR)
         return jsonify({"error": str(e)}), 500
@@ -237,8 +246,8 @@ def video_kyc_status():
 
         response_data['update_status_time'] = added_time()
 
-        FIN_VIDEO_KYC.update_one({'generate_profile_id': profile_id}, {'$set': response_data}, upsert=True)
-        kyc_data = FIN_VIDEO_KYC.find_one({'generate_profile_id': profile_id})
+        kyc_data = FIN_VIDEO_KYC.find_one_and_update({'generate_profile_id': profile_id}, kyc_update(profile_id, 'status', response_data),
+                                                     projection=fields('video_kyc_status'), upsert=True, return_document=ReturnDocument.AFTER)
 
         resources = kyc_data.get('resources', {})
         text = resources.get('text', [])
@@ -315,8 +324,9 @@ def video_view_document():
             '''
 
         response_data['update_status_time'] = added_time()
-        FIN_VIDEO_KYC.update_one({'generate_profile_id': profile_id}, {'$set': response_data}, upsert=True)
-        kyc_data = FIN_VIDEO_KYC.find_one({'generate_profile_id': profile_id})
+
+        kyc_data = FIN_VIDEO_KYC.find_one_and_update({'generate_profile_id': profile_id}, kyc_update(profile_id, 'status', response_data),
+                                                     projection=fields('video_kyc_status'), upsert=True, return_document=ReturnDocument.AFTER)
 
         resources = kyc_data.get('resources', {})
         text = resources.get('text', [])
@@ -363,25 +373,43 @@ def video_view_document():
 
 
 # After video kyc rejected ( tm/sh )
-def video_kyc_reject_resend_link(idfy_received_data, profile_id):
+# progress: steps already done by an earlier attempt ({'new_link', 'new_profile_id', 'email_sent'}), save_progress(step)
+# records a finished step, so a retry reuses the generated link instead of creating another IDfy profile
+def video_kyc_reject_resend_link(idfy_received_data, profile_id, raise_errors=False, progress=None, save_progress=None):
     from aadhar.aadhar import FINVESTA_USERS
 
+    progress = dict(progress or {})
+    save_progress = save_progress or (lambda step: None)
     try:
-        agent_data = FINVESTA_USERS.find_one({'video_kyc.profile_id': profile_id})
+        # An earlier attempt may already have moved the agent to the new profile
+        # $in with a None would also match users without video_kyc.profile_id
+        known_ids = [known for known in (profile_id, progress.get('new_profile_id')) if known]
+        if not known_ids:
+            log_data(message="No profile_id to look the agent up by", event_type='/callback/new/video/link', log_level=logging.ERROR)
+            return "Received Video KYC data", 200
+        agent_data = FINVESTA_USERS.find_one({'video_kyc.profile_id': {'$in': known_ids}})
         if not agent_data:
             log_data(message="Agent data not found in FINVESTA USERS collection", event_type='/callback/new/video/link', log_level=logging.ERROR)
             return "Received Video KYC data", 200
-        
-        new_video_kyc = video_kyc_generate_link(idfy_received_data)
+
+        if not progress.get('new_profile_id'):
+            new_video_kyc = video_kyc_generate_link(idfy_received_data)
+            if not isinstance(new_video_kyc, dict) or not new_video_kyc.get('profile_id'):
+                raise RuntimeError(f"Failed to generate a new video KYC link: {new_video_kyc}")
+            progress.update(new_link=new_video_kyc.get('capture_link'), new_profile_id=new_video_kyc['profile_id'])
+            save_progress({'new_link': progress['new_link'], 'new_profile_id': progress['new_profile_id']})
+
         remarks = idfy_received_data.get('status_detail', '')
-        new_link = new_video_kyc.get('capture_link')
-        new_profile_id = new_video_kyc.get('profile_id')
-    
-        html_body = video_kyc_resend_html_agent(agent_data['first_name'], remarks, new_link, new_profile_id)
-        send_email(VIDEO_KYC_RESEND_SUB_AGENT, agent_data['email_address'], html_body)
-        
-        log_data(message=f"Video KYC re-send link sent successfully to Agent {agent_data['email_address']} {agent_data['first_name']} {new_profile_id}", 
-                 event_type='/callback/new/video/link', log_level=logging.INFO)
+        new_link = progress['new_link']
+        new_profile_id = progress['new_profile_id']
+
+        if not progress.get('email_sent'):
+            html_body = video_kyc_resend_html_agent(agent_data['first_name'], remarks, new_link, new_profile_id)
+            send_email(VIDEO_KYC_RESEND_SUB_AGENT, agent_data['email_address'], html_body)
+            save_progress({'email_sent': True})
+
+            log_data(message=f"Video KYC re-send link sent successfully to Agent {agent_data['email_address']} {agent_data['first_name']} {new_profile_id}",
+                     event_type='/callback/new/video/link', log_level=logging.INFO)
         
         # Update the new profile_id in the video_kyc object of the agent's data
         FINVESTA_USERS.update_one({'_id': agent_data['_id']}, {'$set': {'video_kyc.profile_id': new_profile_id}})
@@ -390,6 +418,8 @@ def video_kyc_reject_resend_link(idfy_received_data, profile_id):
 
     except Exception as e:
         log_data(message=str(e), event_type='/callback/new/video/link', log_level=logging.ERROR)
+        if raise_errors:
+            raise
         return "Received Video KYC data", 200
 
 
@@ -0,0 +1,11 @@
+# Separate process for queued /callback jobs and their outbox side effects, used with CALLBACK_JOB_MODE=worker:
+#   python callback_worker.py
+import logging
+
+from aadhar.aadhar import app
+from aadhar.callback_jobs import run_worker
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        run_worker()
@@ -57,3 +57,136 @@ BHARAT_PAN_VERIFY_URL = os.getenv("BHARAT_PAN_VERIFY_URL")
 BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS=os.getenv("BHARAT_BANK_ACCOUNT_VERIFY_PENNYLESS")
 BANK_ACCOUNT_PENNYDROP_SEND_URL=os.getenv("BANK_ACCOUNT_PENNYDROP_SEND_URL")
 BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL=os.getenv("BANK_ACCOUNT_PENNYDROP_GET_STATUS_URL")
+
+# PostgreSQL log connection pool (per gunicorn worker)
+POSTGRESQL_LOG_POOL_MIN = int(os.getenv('POSTGRESQL_LOG_POOL_MIN', '1'))
+POSTGRESQL_LOG_POOL_MAX = int(os.getenv('POSTGRESQL_LOG_POOL_MAX', '4'))
+POSTGRESQL_LOG_POOL_TIMEOUT = float(os.getenv('POSTGRESQL_LOG_POOL_TIMEOUT', '5'))
+POSTGRESQL_LOG_CONNECT_TIMEOUT = int(os.getenv('POSTGRESQL_LOG_CONNECT_TIMEOUT', '5'))
+POSTGRESQL_LOG_HEALTHCHECK_SECONDS = float(os.getenv('POSTGRESQL_LOG_HEALTHCHECK_SECONDS', '30'))
+
+# Admin endpoints (/admin/...) require this in the Admin-Token header; unset, they answer 401
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+
+# Background log writer (per gunicorn worker)
+LOG_QUEUE_MAX_SIZE = int(os.getenv('LOG_QUEUE_MAX_SIZE', '10000'))
+LOG_QUEUE_FULL_POLICY = os.getenv('LOG_QUEUE_FULL_POLICY', 'block')   # 'block' (wait LOG_QUEUE_PUT_TIMEOUT, then drop) or 'drop'
+LOG_QUEUE_PUT_TIMEOUT = float(os.getenv('LOG_QUEUE_PUT_TIMEOUT', '0.05'))
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', '200'))
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', '1'))
+LOG_SHUTDOWN_TIMEOUT = float(os.getenv('LOG_SHUTDOWN_TIMEOUT', '10'))
+
+# Local spool for log rows while PostgreSQL is unreachable
+LOG_SPOOL_DIR = os.getenv('LOG_SPOOL_DIR', 'aadhar_logs/spool')
+LOG_SPOOL_FSYNC = os.getenv('LOG_SPOOL_FSYNC', 'batch')   # 'always' (every row), 'batch' (every append) or 'never'
+LOG_SPOOL_SEGMENT_BYTES = int(os.getenv('LOG_SPOOL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+LOG_SPOOL_REPLAY_INTERVAL = float(os.getenv('LOG_SPOOL_REPLAY_INTERVAL', '15'))
+LOG_SPOOL_CLAIM_TIMEOUT = float(os.getenv('LOG_SPOOL_CLAIM_TIMEOUT', '600'))
+
+# idfy_logging partitions on data_received_time
+LOG_PARTITION_INTERVAL = os.getenv('LOG_PARTITION_INTERVAL', 'daily')   # 'daily' or 'monthly'
+LOG_PARTITION_PREMAKE = int(os.getenv('LOG_PARTITION_PREMAKE', '3'))   # future partitions kept ready
+LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', '90'))
+LOG_MAINTENANCE_INTERVAL = float(os.getenv('LOG_MAINTENANCE_INTERVAL', '3600'))
+
+# log_data payload budget
+LOG_PAYLOAD_MAX_BYTES = int(os.getenv('LOG_PAYLOAD_MAX_BYTES', '16384'))
+LOG_MAX_STRING_LENGTH = int(os.getenv('LOG_MAX_STRING_LENGTH', '2048'))
+LOG_MAX_LIST_ITEMS = int(os.getenv('LOG_MAX_LIST_ITEMS', '20'))
+LOG_ELIDE_KEYS = [key.strip() for key in os.getenv('LOG_ELIDE_KEYS', 'image,resources,tasks,xml_output,file_object').split(',') if key.strip()]
+LOG_INFO_SAMPLE_RATE = float(os.getenv('LOG_INFO_SAMPLE_RATE', '1'))
+# Per event_type overrides, e.g. {"/callback/POST": {"max_bytes": 4096, "info_sample_rate": 0.2, "elide_keys": ["resources"]}}
+LOG_EVENT_POLICIES = os.getenv('LOG_EVENT_POLICIES', '{}')
+
+# Outbound HTTP sessions (per upstream, per gunicorn worker)
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+HTTP_FILE_READ_TIMEOUT = float(os.getenv('HTTP_FILE_READ_TIMEOUT', '120'))
+HTTP_GET_RETRIES = int(os.getenv('HTTP_GET_RETRIES', '3'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
+IDFY_STATUS_READ_TIMEOUT = float(os.getenv('IDFY_STATUS_READ_TIMEOUT', '5'))   # poller status checks, never retried; the next tick is the retry
+
+# Async IDfy task mode (/pancard, /aadharcard answer 202 and finish in the background)
+IDFY_ASYNC_MODE = os.getenv('IDFY_ASYNC_MODE', 'false').lower() == 'true'   # otherwise only with "Prefer: respond-async"
+IDFY_ASYNC_WORKERS = int(os.getenv('IDFY_ASYNC_WORKERS', '8'))
+IDFY_TASK_LEASE_SECONDS = int(os.getenv('IDFY_TASK_LEASE_SECONDS', '60'))
+
+# Shared IDfy status poller (per gunicorn worker) and its adaptive schedule
+IDFY_POLL_CONCURRENCY = int(os.getenv('IDFY_POLL_CONCURRENCY', '4'))
+IDFY_POLL_FIRST_PROBE = float(os.getenv('IDFY_POLL_FIRST_PROBE', '1'))   # until completion times have been observed
+IDFY_POLL_MIN_DELAY = float(os.getenv('IDFY_POLL_MIN_DELAY', '0.5'))
+IDFY_POLL_MAX_DELAY = float(os.getenv('IDFY_POLL_MAX_DELAY', '5'))
+IDFY_POLL_BACKOFF = float(os.getenv('IDFY_POLL_BACKOFF', '1.6'))
+IDFY_POLL_JITTER = float(os.getenv('IDFY_POLL_JITTER', '0.2'))
+IDFY_POLL_COALESCE = float(os.getenv('IDFY_POLL_COALESCE', '0.25'))   # ids due within this window share a tick
+IDFY_POLL_HISTORY = int(os.getenv('IDFY_POLL_HISTORY', '500'))
+IDFY_AADHAAR_DEADLINE = float(os.getenv('IDFY_AADHAAR_DEADLINE', '20'))
+IDFY_PAN_DEADLINE = float(os.getenv('IDFY_PAN_DEADLINE', '25'))
+
+# IDfy task completions posted to /callback wake waiters directly; polling is the fallback
+IDFY_CALLBACK_GRACE = float(os.getenv('IDFY_CALLBACK_GRACE', '0'))   # >0 holds the first status probe back to give the callback a chance
+IDFY_TASK_EVENT_POLL_INTERVAL = float(os.getenv('IDFY_TASK_EVENT_POLL_INTERVAL', '0.5'))   # used when change streams are unavailable
+IDFY_TASK_EVENT_TTL_SECONDS = int(os.getenv('IDFY_TASK_EVENT_TTL_SECONDS', '3600'))
+
+# Video KYC callback job queue
+CALLBACK_JOB_MODE = os.getenv('CALLBACK_JOB_MODE', 'local')   # 'local' (thread in each web worker) or 'worker' (python callback_worker.py)
+CALLBACK_WORKER_CONCURRENCY = int(os.getenv('CALLBACK_WORKER_CONCURRENCY', '4'))
+CALLBACK_JOB_MAX_ATTEMPTS = int(os.getenv('CALLBACK_JOB_MAX_ATTEMPTS', '5'))
+CALLBACK_JOB_RETRY_BASE = float(os.getenv('CALLBACK_JOB_RETRY_BASE', '30'))
+CALLBACK_JOB_LEASE_SECONDS = int(os.getenv('CALLBACK_JOB_LEASE_SECONDS', '900'))
+CALLBACK_JOB_POLL_INTERVAL = float(os.getenv('CALLBACK_JOB_POLL_INTERVAL', '1'))
+
+# Streaming IDfy -> S3 transfers
+S3_PART_SIZE = int(os.getenv('S3_PART_SIZE', str(8 * 1024 * 1024)))   # S3 minimum is 5 MB
+S3_TRANSFER_CONCURRENCY = int(os.getenv('S3_TRANSFER_CONCURRENCY', '4'))   # parts in flight per transfer
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '50'))
+S3_ARCHIVE_WORKERS = int(os.getenv('S3_ARCHIVE_WORKERS', '8'))   # files archived at once per process, across profiles
+S3_ARCHIVE_PER_HOST = int(os.getenv('S3_ARCHIVE_PER_HOST', '4'))   # concurrent downloads from one source host
+
+# /callback dedup ledger
+CALLBACK_LEDGER_TTL_DAYS = int(os.getenv('CALLBACK_LEDGER_TTL_DAYS', '30'))   # redeliveries older than this are processed again
+CALLBACK_LEDGER_RECLAIM_SECONDS = int(os.getenv('CALLBACK_LEDGER_RECLAIM_SECONDS', '300'))   # a claim not marked done by then is taken to have crashed
+
+# Outbox for /callback side effects (agent code, DS auto-approval, reject resend link)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_RETRY_BASE = float(os.getenv('OUTBOX_RETRY_BASE', '15'))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '300'))
+# Per effect limit on concurrent dispatches per process, e.g. {"agent_code": 2}
+OUTBOX_EFFECT_CONCURRENCY = os.getenv('OUTBOX_EFFECT_CONCURRENCY', '{"agent_code": 2, "resend_link": 2, "ds_auto_approve": 4}')
+
+# MongoDB indexes (registry in aadhar/mongo_indexes.py; deploy step: python -m aadhar.mongo_indexes ensure)
+MONGO_INDEX_BOOTSTRAP = os.getenv('MONGO_INDEX_BOOTSTRAP', 'true').lower() == 'true'   # also create missing indexes when a worker starts
+
+# Hot/cold split of video KYC documents (python -m aadhar.payload_store migrate)
+VIDEO_KYC_MIGRATION_BATCH = int(os.getenv('VIDEO_KYC_MIGRATION_BATCH', '200'))
+VIDEO_KYC_MIGRATION_PAUSE = float(os.getenv('VIDEO_KYC_MIGRATION_PAUSE', '0.5'))   # seconds between batches
+
+# MongoDB client (one per gunicorn worker, built after fork)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '5'))   # opened by the warm-up, kept idle
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+WARM_UP_CLIENTS = os.getenv('WARM_UP_CLIENTS', 'true').lower() == 'true'   # gunicorn post_worker_init hook
+
+# /pancard verification cache (PANCARD_DATA, optional in-process LRU in front)
+PAN_CACHE_TTL_SECONDS = int(os.getenv('PAN_CACHE_TTL_SECONDS', '900'))   # 0 turns the cache off
+PAN_CACHE_LRU_SIZE = int(os.getenv('PAN_CACHE_LRU_SIZE', '1024'))   # 0 skips the in-process front
+PAN_CACHE_HMAC_KEY = os.getenv('PAN_CACHE_HMAC_KEY')   # unset: derived from AES_ENCRYPT_SECRET_KEY with HKDF, never the AES key itself
+
+# Single-flight coalescing of identical vendor calls (in-process and across workers via a Mongo lease)
+SINGLE_FLIGHT_LEASE_SECONDS = int(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', '60'))   # longer than the slowest coalesced call
+SINGLE_FLIGHT_RESULT_SECONDS = float(os.getenv('SINGLE_FLIGHT_RESULT_SECONDS', '5'))   # how long a finished result is handed to late joiners
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.25'))
+
+# Idempotency-Key on KYC initiation endpoints (/aadharcard, /pancard, /generate/link, /aadhaar/send-otp)
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))   # how long a stored response is replayed
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60'))   # a request still "processing" after this can be re-run
+
+# Circuit breakers per vendor endpoint (per gunicorn worker)
+CIRCUIT_WINDOW_SECONDS = float(os.getenv('CIRCUIT_WINDOW_SECONDS', '60'))   # rolling window the rates are computed over
+CIRCUIT_MIN_REQUESTS = int(os.getenv('CIRCUIT_MIN_REQUESTS', '10'))   # fewer calls than this in the window never open the breaker
+CIRCUIT_ERROR_RATE = float(os.getenv('CIRCUIT_ERROR_RATE', '0.5'))   # share of connection errors/5xx that opens it
+CIRCUIT_SLOW_SECONDS = float(os.getenv('CIRCUIT_SLOW_SECONDS', '10'))
+CIRCUIT_SLOW_RATE = float(os.getenv('CIRCUIT_SLOW_RATE', '0.8'))   # share of calls slower than CIRCUIT_SLOW_SECONDS that opens it
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))   # before a half-open probe is let through
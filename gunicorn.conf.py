@@ -0,0 +1,24 @@
+# Picked up automatically by gunicorn from the working directory (CMD in the Dockerfile)
+from config import CALLBACK_JOB_MODE, WARM_UP_CLIENTS
+
+
+def post_fork(server, worker):
+    # Fresh Mongo/S3/HTTP/PostgreSQL clients for this worker, nothing is shared with the master
+    from aadhar.clients import get_mongo_client, get_s3_client
+
+    get_mongo_client()
+    get_s3_client()
+
+
+def post_worker_init(worker):
+    # The app is loaded, the worker hasn't accepted a connection yet
+    if WARM_UP_CLIENTS:
+        from aadhar.clients import warm_up_clients
+
+        warm_up_clients()
+
+    # Local mode drains the callback queue from every web worker; otherwise callback_worker.py does
+    if CALLBACK_JOB_MODE == 'local':
+        from aadhar.callback_jobs import start_local_worker
+
+        start_local_worker()